@@ -57,3 +57,17 @@ class AWSComponent(DeviceComponent, ManagedEntity):
         Return the path to an icon for this component.
         '''
         return '/++resource++aws/img/%s.png' % self.meta_type
+
+    def getPublishPeriod(self):
+        '''
+        Return the interval in seconds at which CloudWatch publishes
+        metrics for this component.
+        '''
+        return 300
+
+    def getAggregateComponentIds(self):
+        '''
+        Return ids of the components whose values can be combined into
+        this component's dimensionless CloudWatch datapoints, or None.
+        '''
+        return None
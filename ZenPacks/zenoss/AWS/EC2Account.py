@@ -34,12 +34,14 @@ class EC2Account(Device):
     ec2secretkey = None
     linuxDeviceClass = None
     windowsDeviceClass = None
+    model_token = None
 
     _properties = Device._properties + (
         {'id': 'ec2accesskey', 'type': 'string'},
         {'id': 'ec2secretkey', 'type': 'string'},
         {'id': 'linuxDeviceClass', 'type': 'string'},
         {'id': 'windowsDeviceClass', 'type': 'string'},
+        {'id': 'model_token', 'type': 'string'},
         )
 
     _relations = Device._relations + (
@@ -124,6 +124,12 @@ class EC2Instance(AWSComponent):
     def getDimension(self):
         return 'InstanceId=%s' % self.id
 
+    def getPublishPeriod(self):
+        if self.detailed_monitoring:
+            return 60
+
+        return 300
+
     def getRegionId(self):
         return self.region().id
 
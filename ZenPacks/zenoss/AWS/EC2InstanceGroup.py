@@ -0,0 +1,97 @@
+##############################################################################
+#
+# Copyright (C) Zenoss, Inc. 2013, all rights reserved.
+#
+# This content is made available according to terms specified in
+# License.zenoss under the directory where your Zenoss product is installed.
+#
+##############################################################################
+
+from zope.component import adapts
+from zope.interface import implements
+
+from Products.ZenRelations.RelSchema import ToManyCont, ToOne
+
+from Products.Zuul.decorators import info
+from Products.Zuul.form import schema
+from Products.Zuul.infos import ProxyProperty
+from Products.Zuul.infos.component import ComponentInfo
+from Products.Zuul.interfaces.component import IComponentInfo
+from Products.Zuul.utils import ZuulMessageFactory as _t
+
+from ZenPacks.zenoss.AWS import MODULE_NAME
+from ZenPacks.zenoss.AWS.AWSComponent import AWSComponent
+
+
+class EC2InstanceGroup(AWSComponent):
+    '''
+    Model class for EC2InstanceGroup.
+
+    A group is the slice of a region's instances sharing an instance
+    type or image. CloudWatch aggregates EC2 metrics across each slice,
+    so one request covers every instance in the group.
+    '''
+
+    meta_type = portal_type = 'EC2InstanceGroup'
+
+    dimension_name = None
+    dimension_value = None
+    instance_count = None
+
+    _properties = AWSComponent._properties + (
+        {'id': 'dimension_name', 'type': 'string'},
+        {'id': 'dimension_value', 'type': 'string'},
+        {'id': 'instance_count', 'type': 'int'},
+        )
+
+    _relations = AWSComponent._relations + (
+        ('region', ToOne(
+            ToManyCont, MODULE_NAME['EC2Region'], 'instance_groups')),
+        )
+
+    def getIconPath(self):
+        '''
+        Return the path to an icon for this component.
+        '''
+        return '/++resource++aws/img/EC2Instance.png'
+
+    def getDimension(self):
+        return '%s=%s' % (self.dimension_name, self.dimension_value)
+
+    def getRegionId(self):
+        return self.region().id
+
+
+class IEC2InstanceGroupInfo(IComponentInfo):
+    '''
+    API Info interface for EC2InstanceGroup.
+    '''
+
+    account = schema.Entity(title=_t(u'Account'))
+    region = schema.Entity(title=_t(u'Region'))
+    dimension_name = schema.TextLine(title=_t(u'Grouped By'))
+    dimension_value = schema.TextLine(title=_t(u'Value'))
+    instance_count = schema.Int(title=_t(u'Number of Instances'))
+
+
+class EC2InstanceGroupInfo(ComponentInfo):
+    '''
+    API Info adapter factory for EC2InstanceGroup.
+    '''
+
+    implements(IEC2InstanceGroupInfo)
+    adapts(EC2InstanceGroup)
+
+    dimension_name = ProxyProperty('dimension_name')
+    dimension_value = ProxyProperty('dimension_value')
+    instance_count = ProxyProperty('instance_count')
+
+    @property
+    @info
+    def account(self):
+        return self._object.device()
+
+    @property
+    @info
+    def region(self):
+        return self._object.region()
@@ -44,6 +44,8 @@ class EC2Region(AWSComponent):
         ('account', ToOne(ToManyCont, MODULE_NAME['EC2Account'], 'regions')),
         ('zones', ToManyCont(ToOne, MODULE_NAME['EC2Zone'], 'region')),
         ('instances', ToManyCont(ToOne, MODULE_NAME['EC2Instance'], 'region')),
+        ('instance_groups', ToManyCont(
+            ToOne, MODULE_NAME['EC2InstanceGroup'], 'region')),
         ('volumes', ToManyCont(ToOne, MODULE_NAME['EC2Volume'], 'region')),
         ('vpcs', ToManyCont(ToOne, MODULE_NAME['EC2VPC'], 'region')),
         ('vpc_subnets', ToManyCont(
@@ -56,6 +58,9 @@ class EC2Region(AWSComponent):
     def getRegionId(self):
         return self.id
 
+    def getAggregateComponentIds(self):
+        return self.instances.objectIds()
+
     @transact
     def discover_guests(self):
         '''
@@ -95,6 +100,7 @@ class IEC2RegionInfo(IComponentInfo):
     account = schema.Entity(title=_t(u'Account'))
     zone_count = schema.Int(title=_t(u'Number of Zones'))
     instance_count = schema.Int(title=_t(u'Number of Instances'))
+    instance_group_count = schema.Int(title=_t(u'Number of Instance Groups'))
     volume_count = schema.Int(title=_t(u'Number of Volumes'))
     vpc_count = schema.Int(title=_t(u'Number of VPCs'))
     vpc_subnet_count = schema.Int(title=_t(u'Number of VPC Subnets'))
@@ -121,6 +127,10 @@ class EC2RegionInfo(ComponentInfo):
     def instance_count(self):
         return self._object.instances.countObjects()
 
+    @property
+    def instance_group_count(self):
+        return self._object.instance_groups.countObjects()
+
     @property
     def volume_count(self):
         return self._object.volumes.countObjects()
@@ -74,6 +74,13 @@ class EC2Volume(AWSComponent):
     def getDimension(self):
         return 'VolumeId=%s' % self.id
 
+    def getPublishPeriod(self):
+        # Provisioned IOPS volumes publish one-minute metrics.
+        if self.volume_type == 'io1':
+            return 60
+
+        return 300
+
     def getRegionId(self):
         return self.region().id
 
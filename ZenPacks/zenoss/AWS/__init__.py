@@ -15,6 +15,7 @@ from Products.ZenModel.ZenPack import ZenPackBase
 productNames = (
     'EC2Account',
     'EC2Instance',
+    'EC2InstanceGroup',
     'EC2Region',
     'EC2Volume',
     'EC2VPC',
@@ -36,4 +37,42 @@ class ZenPack(ZenPackBase):
     '''
     ZenPack loader.
     '''
-    pass
+
+    packZProperties = [
+        ('zAWSCloudWatchMaxParallel', 10, 'int'),
+        ('zAWSCloudWatchGroupByRegion', False, 'boolean'),
+        ('zAWSHTTPMaxPerHost', 10, 'int'),
+        ('zAWSHTTPIdleTimeout', 240, 'int'),
+        ('zAWSUseSSL', False, 'boolean'),
+        ('zAWSRateLimit', 0.0, 'float'),
+        ('zAWSRateBurst', 40, 'int'),
+        ('zAWSCloudWatchMaxBackfill', 3600, 'int'),
+        ('zAWSCloudWatchAlignPolls', False, 'boolean'),
+        ('zAWSEventRefreshInterval', 3600, 'int'),
+        ('zAWSSignatureVersion', 2, 'int'),
+        ('zAWSCloudWatchAggregateRegions', False, 'boolean'),
+        ('zAWSCloudWatchListMetricsInterval', 0, 'int'),
+        ('zAWSModelerMaxParallel', 10, 'int'),
+        ('zAWSModelerFullInterval', 24, 'int'),
+        ]
+
+    def install(self, app):
+        super(ZenPack, self).install(app)
+        self.build_region_relations(app.zport.dmd)
+
+    def build_region_relations(self, dmd):
+        '''
+        Add relationships missing from EC2Region components created by
+        earlier versions, such as instance_groups.
+        '''
+        try:
+            deviceclass = dmd.Devices.getOrganizer('/AWS/EC2')
+        except KeyError:
+            return
+
+        for device in deviceclass.getSubDevicesGen():
+            if not hasattr(device, 'regions'):
+                continue
+
+            for region in device.regions():
+                region.buildRelations()
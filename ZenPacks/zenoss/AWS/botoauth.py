@@ -0,0 +1,52 @@
+##############################################################################
+#
+# Copyright (C) Zenoss, Inc. 2013, all rights reserved.
+#
+# This content is made available according to terms specified in
+# License.zenoss under the directory where your Zenoss product is installed.
+#
+##############################################################################
+
+'''
+Signature version 4 authentication for boto connections.
+
+boto's HmacAuthV4Handler derives the signing key from the secret key
+with four HMAC computations on every request. The handler here uses the
+signing keys shared with the collection signers in utils instead.
+'''
+
+from ZenPacks.zenoss.AWS.utils import addLocalLibPath, signing_key
+
+addLocalLibPath()
+
+import boto
+from boto.auth import HmacAuthV4Handler
+
+
+class CachedHmacAuthV4Handler(HmacAuthV4Handler):
+    '''
+    HmacAuthV4Handler using cached derived signing keys.
+    '''
+
+    # Distinct capability so boto never selects this handler on its own.
+    capability = ['hmac-v4-cached']
+
+    def signature(self, http_request, string_to_sign):
+        new_hmac = signing_key(
+            self._provider.secret_key,
+            http_request.timestamp,
+            http_request.region_name,
+            http_request.service_name).copy()
+
+        new_hmac.update(string_to_sign)
+        return new_hmac.hexdigest()
+
+
+def use_sigv4(connection):
+    '''
+    Switch boto connection to signature version 4 and return it.
+    '''
+    connection._auth_handler = CachedHmacAuthV4Handler(
+        connection.host, boto.config, connection.provider)
+
+    return connection
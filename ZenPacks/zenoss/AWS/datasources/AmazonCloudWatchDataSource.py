@@ -10,18 +10,18 @@
 import logging
 log = logging.getLogger('zen.AWS')
 
-import datetime
+import re
 import time
-import calendar
 import random
+import collections
+import math
 
-from cStringIO import StringIO
-from lxml import etree
-
-from twisted.web.client import getPage
+from functools import partial
+from itertools import chain
 
 from twisted.internet import reactor, defer
 from twisted.internet.defer import inlineCallbacks
+from twisted.python.failure import Failure
 
 from zope.component import adapts
 from zope.interface import implements
@@ -36,12 +36,451 @@ from Products.Zuul.utils import ZuulMessageFactory as _t
 from ZenPacks.zenoss.PythonCollector.datasources.PythonDataSource \
     import PythonDataSource, PythonDataSourcePlugin
 
+from ZenPacks.zenoss.AWS import httpclient, parsers, ratelimit
 from ZenPacks.zenoss.AWS.utils \
-    import awsUrlSign, iso8601, result_errmsg, lookup_cwregion
+    import get_signer, iso8601, result_errmsg
+from ZenPacks.zenoss.AWS.utils import lookup_cwregion, lookup_ec2region
 
 
 MAX_RETRIES = 3
 
+# CloudWatch returns at most this many datapoints per request.
+MAX_DATAPOINTS = 1440
+
+# Timestamp of the newest value stored for each datasource, keyed by
+# (device id, component, datasource). Used to request only the window
+# since the last stored value.
+_last_timestamps = {}
+
+# Timestamp of the last value written for each datapoint, keyed by
+# (device id, component, datasource, datapoint). Points that are not
+# newer are not written again. Only timestamps are compared: RRD can't
+# replace a value already written, so a value CloudWatch revises after
+# it was collected is never written.
+_last_written = {}
+
+# Number of datapoint writes suppressed as duplicates, per device id.
+suppressed_writes = collections.Counter()
+
+# Observed delay in seconds between the end of a publish period and the
+# data being available from CloudWatch, learned per datasource and keyed
+# like _last_timestamps.
+DEFAULT_PUBLISH_LAG = 120
+MAX_PUBLISH_LAG = 600
+_publish_lag = {}
+
+# Whether the previous aligned poll of each datasource returned a newer
+# period, keyed like _last_timestamps.
+_polled_new_data = {}
+
+# Aligned polls expected to wait at least this fraction of the cycle
+# are skipped. The next cycle requests the same window.
+MAX_ALIGN_DELAY = 0.8
+
+# Number of requests skipped because no new data could exist yet, per
+# device id.
+skipped_requests = collections.Counter()
+
+# Number of failed requests, per device id.
+failed_requests = collections.Counter()
+
+# Last state and send time of events sent only on change, keyed by
+# (device id, component, event key).
+_event_states = {}
+
+# Per-component state not updated for this many zAWSCloudWatchMaxBackfill
+# windows belongs to components no longer collected and is dropped.
+STATE_EXPIRY_WINDOWS = 4
+
+# When state was last pruned, per device id.
+_last_pruned = {}
+
+# Identical GetMetricStatistics requests made within this many seconds
+# of each other share one response.
+SHARED_REQUEST_TTL = 60
+
+# Pending Deferreds or (expires, result) for shared requests. Results
+# are parsed, never response bodies, and removed when they expire.
+_shared_requests = {}
+
+# Seconds before a failed ListMetrics request is made again. Until then
+# every metric is requested.
+LIST_METRICS_RETRY = 3600
+
+# Number of requests answered by an identical request, per device id.
+shared_requests = collections.Counter()
+
+# Number of requests skipped because ListMetrics showed the metric has
+# no data, per device id.
+pruned_requests = collections.Counter()
+
+# Volume ids per DescribeVolumeStatus request. Keeps the signed GET
+# request well under common URL length limits.
+VOLUME_STATUS_BATCH = 200
+
+# Volume ids in an error message. Ids have 8 or 17 hex digits.
+VOLUME_ID = re.compile(r'\bvol-[0-9a-f]+\b')
+
+# Shared RegionVolumeStatus per (access key, region).
+_volume_status = {}
+
+
+class RegionVolumeStatus(object):
+    '''
+    Status of the EBS volumes collected in one region.
+
+    Shared by every task using the same access key. Each fetch covers
+    every volume collected in the region within the last two cycles, so
+    volume status is requested about once per region per cycle even
+    though each volume's task starts at a different time.
+    '''
+
+    def __init__(self, clock=None):
+        if clock is None:
+            clock = reactor
+
+        self.clock = clock
+        self.seen = {}
+        self.updated = {}
+        self.statuses = {}
+        self.scheduled = None
+        self.inflight = None
+
+    def get(self, volume_ids, max_age, fetch):
+        '''
+        Return a Deferred that fires with {volume_id: status}.
+
+        fetch is called with a sorted list of volume ids when the status
+        of any of volume_ids is older than max_age. It includes every
+        volume requested within the last two max_age periods.
+        '''
+        now = self.clock.seconds()
+        for volume_id in volume_ids:
+            self.seen[volume_id] = now
+
+        if all(x in self.updated and now - self.updated[x] < max_age
+               for x in volume_ids):
+            return defer.succeed(self.statuses)
+
+        d = defer.Deferred()
+
+        if self.inflight and self.inflight[0].issuperset(volume_ids):
+            self.inflight[1].append(d)
+            return d
+
+        if self.scheduled is None:
+            self.scheduled = []
+
+            # Let tasks started in the same reactor iteration register
+            # their volumes before the request is made.
+            self.clock.callLater(0, self._update, max_age, fetch)
+
+        self.scheduled.append(d)
+        return d
+
+    def _update(self, max_age, fetch):
+        now = self.clock.seconds()
+
+        # Volumes no longer collected drop out after two periods.
+        for volume_id, seen in self.seen.items():
+            if now - seen >= max_age * 2:
+                del self.seen[volume_id]
+                self.updated.pop(volume_id, None)
+                self.statuses.pop(volume_id, None)
+
+        volume_ids = frozenset(self.seen)
+        waiting = self.scheduled
+
+        self.scheduled = None
+        self.inflight = (volume_ids, waiting)
+
+        def success(statuses):
+            self.inflight = None
+
+            updated = self.clock.seconds()
+            for volume_id in volume_ids:
+                self.updated[volume_id] = updated
+                self.statuses.pop(volume_id, None)
+
+            self.statuses.update(statuses)
+
+            for d in waiting:
+                d.callback(self.statuses)
+
+        def failure(result):
+            self.inflight = None
+
+            for d in waiting:
+                d.errback(result)
+
+        d = defer.maybeDeferred(fetch, sorted(volume_ids))
+        d.addCallbacks(success, failure)
+
+
+class MetricListing(object):
+    '''
+    Metrics listed by ListMetrics for one namespace in one region.
+    '''
+
+    def __init__(self, metrics):
+        self.metrics = frozenset(metrics)
+        self.names = frozenset(x[0] for x in self.metrics)
+        self.dimensions = frozenset(x[1] for x in self.metrics)
+
+    def may_exist(self, metric, dimensions):
+        '''
+        Return False if metric can't have data for dimensions.
+
+        Metrics for dimensions that aren't listed at all may belong to
+        resources created since the listing, so only metrics missing for
+        listed dimensions, or missing entirely, are ruled out.
+        '''
+        dimensions = tuple(sorted(dimensions))
+
+        if (metric, dimensions) in self.metrics:
+            return True
+
+        return metric in self.names and dimensions not in self.dimensions
+
+
+def state_changed(key, state, refresh_interval, now=None):
+    '''
+    Return True if an event for key with state should be sent.
+
+    Events are sent when state differs from the last state sent for key,
+    or when the last one was sent more than refresh_interval seconds
+    ago. A refresh_interval of 0 sends every event.
+    '''
+    if now is None:
+        now = time.time()
+
+    last_state, last_sent = _event_states.get(key, (None, 0))
+
+    if state == last_state and refresh_interval and \
+            now - last_sent < refresh_interval:
+        return False
+
+    _event_states[key] = (state, now)
+    return True
+
+
+def prune_state(device_id, max_age, refresh_interval=0, now=None):
+    '''
+    Drop the per-component state of device_id that has not been
+    updated for max_age seconds, such as that of terminated instances.
+
+    Unchanged events are only sent every refresh_interval seconds, so
+    their states are kept that much longer.
+    '''
+    if now is None:
+        now = time.time()
+
+    cutoff = now - max_age
+
+    for key, timestamp in _last_timestamps.items():
+        if key[0] == device_id and timestamp < cutoff:
+            del _last_timestamps[key]
+
+    for state in (_publish_lag, _polled_new_data):
+        for key in state.keys():
+            if key[0] == device_id and key not in _last_timestamps:
+                del state[key]
+
+    for key, timestamp in _last_written.items():
+        if key[0] == device_id and timestamp < cutoff:
+            del _last_written[key]
+
+    for key, (_, sent) in _event_states.items():
+        if key[0] == device_id and sent < cutoff - refresh_interval:
+            del _event_states[key]
+
+
+def shared_request(key, request, ttl=SHARED_REQUEST_TTL, failure_ttl=0):
+    '''
+    Return (Deferred, shared). The Deferred fires with the response to
+    request(). shared is True if no new request was made.
+
+    Calls with the same key while a request is in progress, or within
+    ttl seconds of its response, get the same response instead of
+    making their own request. Failures are shared with calls made
+    within failure_ttl seconds.
+    '''
+    now = time.time()
+    entry = _shared_requests.get(key)
+
+    if isinstance(entry, list):
+        d = defer.Deferred()
+        entry.append(d)
+        return d, True
+
+    if entry is not None:
+        expires, response = entry
+        if expires > now:
+            if isinstance(response, Failure):
+                return defer.fail(response), True
+
+            return defer.succeed(response), True
+
+    waiting = _shared_requests[key] = []
+
+    def success(response):
+        entry = _shared_requests[key] = (time.time() + ttl, response)
+
+        # Responses are only held until they expire.
+        reactor.callLater(ttl, expire_shared_request, key, entry)
+
+        for d in waiting:
+            d.callback(response)
+
+        return response
+
+    def failure(result):
+        if failure_ttl:
+            entry = _shared_requests[key] = (
+                time.time() + failure_ttl, result)
+
+            reactor.callLater(failure_ttl, expire_shared_request, key, entry)
+        else:
+            del _shared_requests[key]
+
+        for d in waiting:
+            d.errback(result)
+
+        return result
+
+    d = defer.maybeDeferred(request)
+    d.addCallbacks(success, failure)
+    return d, False
+
+
+def expire_shared_request(key, entry):
+    '''
+    Remove entry from the shared requests unless it has been replaced.
+    '''
+    if _shared_requests.get(key) is entry:
+        del _shared_requests[key]
+
+
+def mean(values):
+    return sum(values) / len(values)
+
+
+# Functions combining per-component values of each statistic.
+AGGREGATES = {
+    'Average': mean,
+    'Sum': sum,
+    'SampleCount': sum,
+    'Maximum': max,
+    'Minimum': min,
+    }
+
+
+def aggregate_members(statistics, sources):
+    '''
+    Return parsed GetMetricStatistics members aggregating sources.
+
+    sources is a list of members lists, one per component, or None for
+    components that returned nothing. Only timestamps reported by every
+    component that returned data are included, so a period is not
+    aggregated while some components have yet to publish it.
+    '''
+    values = collections.defaultdict(lambda: collections.defaultdict(list))
+    reporting = 0
+
+    for members in sources:
+        if not members:
+            continue
+
+        reporting += 1
+        for timestamp, member in members:
+            for statistic in statistics:
+                value = member.get(statistic)
+                if value is not None:
+                    values[timestamp][statistic].append(float(value))
+
+    aggregated = []
+    for timestamp in sorted(values):
+        member = {}
+        for statistic, statistic_values in values[timestamp].iteritems():
+            if len(statistic_values) == reporting:
+                member[statistic] = repr(
+                    AGGREGATES[statistic](statistic_values))
+
+        if member:
+            aggregated.append((timestamp, member))
+
+    return aggregated
+
+
+def missing_volumes(error, volume_ids):
+    '''
+    Return the volume ids in volume_ids reported as not existing by an
+    InvalidVolume.NotFound error response.
+    '''
+    body = getattr(error, 'response', None) or ''
+    if '<Code>InvalidVolume.NotFound</Code>' not in body:
+        return set()
+
+    message = re.search(r'<Message>(.*?)</Message>', body, re.DOTALL)
+    if not message:
+        return set()
+
+    return set(VOLUME_ID.findall(message.group(1))).intersection(volume_ids)
+
+
+@inlineCallbacks
+def describe_volume_status(device_id, region, volume_ids, request_page):
+    '''
+    Return a Deferred that fires with {volume_id: status} for the
+    volumes in volume_ids that still exist.
+
+    request_page(volume_ids, next_token) returns a Deferred that fires
+    with one DescribeVolumeStatus response body.
+    '''
+    statuses = {}
+
+    chunks = [
+        volume_ids[i:i + VOLUME_STATUS_BATCH]
+        for i in xrange(0, len(volume_ids), VOLUME_STATUS_BATCH)]
+
+    while chunks:
+        chunk = chunks.pop(0)
+        next_token = None
+
+        log.debug(
+            '%s (%s): requesting status of %s volumes',
+            device_id, region, len(chunk))
+
+        while True:
+            try:
+                result = yield request_page(chunk, next_token)
+
+            except Exception, ex:
+                # Volumes deleted since modeling fail the whole request.
+                # Drop them and request the rest again. Pages already
+                # received are requested again too.
+                missing = missing_volumes(ex, chunk)
+                if not missing:
+                    raise
+
+                log.debug(
+                    '%s (%s): volumes no longer exist: %s',
+                    device_id, region, ', '.join(sorted(missing)))
+
+                chunk = [x for x in chunk if x not in missing]
+                if chunk:
+                    chunks.insert(0, chunk)
+
+                break
+
+            page, next_token = parsers.parse_volume_status(result)
+            statuses.update(page)
+
+            if not next_token:
+                break
+
+    defer.returnValue(statuses)
+
 
 class AmazonCloudWatchDataSource(PythonDataSource):
     '''
@@ -91,7 +530,7 @@ class IAmazonCloudWatchDataSourceInfo(IRRDDataSourceInfo):
 
     statistic = schema.TextLine(
         group=_t('Amazon CloudWatch'),
-        title=_t('Statistic'))
+        title=_t('Statistics'))
 
     dimension = schema.TextLine(
         group=_t('Amazon CloudWatch'),
@@ -121,24 +560,246 @@ class AmazonCloudWatchDataSourceInfo(RRDDataSourceInfo):
     region = ProxyProperty('region')
 
 
-def timestamp_from_cloudwatch(cloudwatch_time_string):
-    try:
-        return calendar.timegm(
-            time.strptime(cloudwatch_time_string, '%Y-%m-%dT%H:%M:%SZ'))
+def parse_dimensions(dimension):
+    '''
+    Return a list of (name, value) tuples given a dimension string of
+    semicolon-separated Name=Value pairs such as InstanceId=i-12345678
+    or AutoScalingGroupName=web;InstanceType=m1.small.
+    '''
+    dimensions = []
+    for pair in (dimension or '').split(';'):
+        if not pair.strip():
+            continue
+
+        name, value = pair.split('=', 1)
+        dimensions.append((name.strip(), value.strip()))
+
+    return dimensions
+
+
+def split_statistics(statistic):
+    '''
+    Return a list of statistics given a comma-separated string such as
+    "Average, Maximum".
+    '''
+    return [x.strip() for x in statistic.split(',') if x.strip()]
+
+
+def statistic_datapoints(ds):
+    '''
+    Return a list of (statistic, key) tuples for a datasource config.
+
+    The first statistic is stored under the datasource's own id. Every
+    statistic is also stored under a datapoint with the same id as the
+    statistic, e.g. a "Maximum" datapoint receives the Maximum value.
+    These are keyed by the datapoint's full datasource_datapoint name
+    so datasources sharing a component and task don't collide.
+    '''
+    statistics = ds.params['statistics']
+    if not statistics:
+        return []
+
+    mapping = [(statistics[0], ds.datasource)]
+
+    point_ids = set(dp.id for dp in getattr(ds, 'points', ()))
+    for statistic in statistics:
+        if statistic in point_ids and statistic != ds.datasource:
+            mapping.append((statistic, '%s_%s' % (ds.datasource, statistic)))
+
+    return mapping
+
+
+def window_key(config, ds):
+    '''
+    Return the _last_timestamps key for a datasource config.
+    '''
+    return (config.id, ds.component, ds.datasource)
+
+
+def seconds_ago_for(last, cycletime, max_backfill, now=None):
+    '''
+    Return how many seconds back a request should start.
+
+    Without a previously stored value the last two periods are
+    requested. Otherwise the request starts at the first period after
+    the last stored value, capped at max_backfill seconds and at the
+    number of datapoints CloudWatch will return.
+    '''
+    if not last:
+        return cycletime * 2
+
+    if now is None:
+        now = time.time()
+
+    limit = min(max_backfill or cycletime * 2, cycletime * MAX_DATAPOINTS)
+
+    return max(cycletime, min(now - (last + cycletime), limit))
+
+
+def published_at(timestamp, cycletime, publish_period):
+    '''
+    Return when CloudWatch publishes the period starting at timestamp,
+    not including ingestion lag.
+    '''
+    publish_period = max(publish_period or cycletime, 60)
+
+    return math.ceil(
+        float(timestamp + cycletime) / publish_period) * publish_period
+
+
+def publish_delay(key, last, cycletime, publish_period, now=None):
+    '''
+    Return seconds until the period following last is expected to be
+    available from CloudWatch for the datasource with window_key key,
+    or 0 if it should be available now.
+    '''
+    if not last:
+        return 0
+
+    if now is None:
+        now = time.time()
+
+    available = published_at(last + cycletime, cycletime, publish_period)
+    available += _publish_lag.get(key, DEFAULT_PUBLISH_LAG)
+
+    return max(0, available - now)
+
+
+def learn_publish_lag(key, observed=None):
+    '''
+    Update the publish lag estimate for the datasource with window_key
+    key.
+
+    observed is the lag of a newly returned period, or None if an
+    aligned poll found nothing new. Polling too early backs off
+    quickly. Since polls never happen before the estimate, an observed
+    lag is only an upper bound and the estimate converges down slowly.
+    '''
+    lag = _publish_lag.get(key, DEFAULT_PUBLISH_LAG)
+
+    if observed is None:
+        lag = min(MAX_PUBLISH_LAG, lag * 1.5 + 10)
+    else:
+        lag = 0.8 * lag + 0.2 * min(lag, max(0, observed))
+
+    _publish_lag[key] = lag
+
+
+def datapoints_from_response(config, ds, body):
+    '''
+    Return a list of (component, datapoint, value, timestamp) tuples
+    given the GetMetricStatistics response body for ds.
+    '''
+    return datapoints_from_members(
+        config, ds, parsers.parse_metric_statistics(body))
+
+
+def datapoints_from_members(config, ds, members):
+    '''
+    Return a list of (component, datapoint, value, timestamp) tuples
+    given parsed GetMetricStatistics members for ds.
+
+    Points that are not newer than the last value stored for their
+    datapoint are dropped, and the stored window is advanced.
+    '''
+    key = window_key(config, ds)
+
+    previous = _last_timestamps.get(key)
+    newer = bool(members) and members[-1][0] > (previous or 0)
+
+    if ds.zAWSCloudWatchAlignPolls:
+        if previous and newer:
+            learn_publish_lag(
+                key,
+                time.time() - published_at(
+                    members[-1][0],
+                    (ds.cycletime / 60) * 60,
+                    ds.params['publish_period']))
+
+        elif previous and _polled_new_data.get(key):
+            # Only a poll following one that found new data shows the
+            # poll was early. Stopped instances publish nothing at all.
+            learn_publish_lag(key)
+
+        _polled_new_data[key] = newer
+
+    if not members:
+        # No value in response. This is usually normal.
+        return []
+
+    datapoints = []
+    suppressed = 0
 
-    except Exception:
-        pass
+    for statistic, dp_key in statistic_datapoints(ds):
+        written_key = (config.id, ds.component, ds.datasource, dp_key)
+        last_written = _last_written.get(written_key, 0)
 
-    return calendar.timegm(datetime.datetime.utcnow().timetuple())
+        newest = None
+        for timestamp, statistics in members:
+            value = statistics.get(statistic)
+            if value is None:
+                continue
+
+            # Already written. Basic monitoring publishes every five
+            # minutes, so the newest point is often returned again on
+            # the next cycle.
+            if timestamp <= last_written:
+                suppressed += 1
+                continue
+
+            datapoints.append((ds.component, dp_key, value, timestamp))
+            newest = timestamp
+
+        if newest:
+            _last_written[written_key] = newest
+
+    _last_timestamps[key] = max(members[-1][0], _last_timestamps.get(key, 0))
+
+    if suppressed:
+        suppressed_writes[config.id] += suppressed
+        log.debug(
+            '%s: suppressed %s duplicate writes for %s %s (%s total)',
+            config.id, suppressed, ds.component, ds.datasource,
+            suppressed_writes[config.id])
+
+    return datapoints
 
 
 class AmazonCloudWatchDataSourcePlugin(PythonDataSourcePlugin):
     proxy_attributes = (
         'ec2accesskey', 'ec2secretkey',
+        'zAWSCloudWatchMaxParallel',
+        'zAWSHTTPMaxPerHost', 'zAWSHTTPIdleTimeout',
+        'zAWSUseSSL',
+        'zAWSRateLimit', 'zAWSRateBurst',
+        'zAWSCloudWatchMaxBackfill',
+        'zAWSCloudWatchAlignPolls',
+        'zAWSEventRefreshInterval',
+        'zAWSSignatureVersion',
+        'zAWSCloudWatchListMetricsInterval',
         )
 
     @classmethod
     def config_key(cls, datasource, context):
+        if getattr(context.device(), 'zAWSCloudWatchGroupByRegion', False):
+            # One task collects every datasource in the region.
+            return (
+                context.device().id,
+                datasource.getCycleTime(context),
+                context.getRegionId(),
+                )
+
+        if getattr(context.device(), 'zAWSCloudWatchAggregateRegions', False):
+            # Region datasources are computed from the instances
+            # collected for the same metric, so they share a task.
+            return (
+                context.device().id,
+                datasource.getCycleTime(context),
+                context.getRegionId(),
+                datasource.namespace,
+                datasource.metric,
+                )
+
         return(
             context.device().id,
             datasource.getCycleTime(context),
@@ -150,18 +811,26 @@ class AmazonCloudWatchDataSourcePlugin(PythonDataSourcePlugin):
 
     @classmethod
     def params(cls, datasource, context):
-        return {
+        params = {
             'namespace': datasource.talesEval(datasource.namespace, context),
             'metric': datasource.talesEval(datasource.metric, context),
             'statistic': datasource.talesEval(datasource.statistic, context),
+            'statistics': split_statistics(
+                datasource.talesEval(datasource.statistic, context)),
             'dimension': datasource.talesEval(datasource.dimension, context),
             'region': datasource.talesEval(datasource.region, context),
+            'publish_period': context.getPublishPeriod(),
             }
 
-    @inlineCallbacks
+        if not params['dimension'] and getattr(
+                context.device(), 'zAWSCloudWatchAggregateRegions', False):
+            params['aggregate_components'] = \
+                context.getAggregateComponentIds()
+
+        return params
+
     def collect(self, config):
         log.debug("Collect for AWS")
-        results = []
 
         ds0 = config.datasources[0]
         accesskey = ds0.ec2accesskey
@@ -170,46 +839,50 @@ class AmazonCloudWatchDataSourcePlugin(PythonDataSourcePlugin):
         # CloudWatch only accepts periods that are evenly divisible by 60.
         cycletime = (ds0.cycletime / 60) * 60
 
-        # Static for performance collection
-        httpVerb = 'GET'
-        uriRequest = '/'
+        # Components can come and go, so state not updated for several
+        # backfill windows is dropped once per window.
+        window = ds0.zAWSCloudWatchMaxBackfill or cycletime * 2
+        if time.time() - _last_pruned.get(config.id, 0) > window:
+            _last_pruned[config.id] = time.time()
+            prune_state(
+                config.id,
+                window * STATE_EXPIRY_WINDOWS,
+                ds0.zAWSEventRefreshInterval)
+
+        scheme = 'https' if ds0.zAWSUseSSL else 'http'
 
-        baseRequest = {}
-        baseRequest['SignatureMethod'] = 'HmacSHA256'
-        baseRequest['SignatureVersion'] = '2'
+        # Connections are pooled and kept alive across all tasks.
+        httpclient.configure(
+            max_per_host=ds0.zAWSHTTPMaxPerHost,
+            idle_timeout=ds0.zAWSHTTPIdleTimeout)
 
         def sleep(secs):
             d = defer.Deferred()
             reactor.callLater(secs, d.callback, None)
             return d
 
-        for ds in config.datasources:
-            hostHeader = lookup_cwregion(ds.params['region'])
-
-            monitorRequest = baseRequest.copy()
-            monitorRequest['Action'] = 'GetMetricStatistics'
-            monitorRequest['Version'] = '2010-08-01'
-            monitorRequest['Period'] = cycletime
-            monitorRequest['StartTime'] = iso8601(seconds_ago=(cycletime * 2))
-            monitorRequest['EndTime'] = iso8601()
-            monitorRequest['Namespace'] = ds.params['namespace']
-            monitorRequest['MetricName'] = ds.params['metric']
-            monitorRequest['Statistics.member.1'] = ds.params['statistic']
+        def bucket_for(hostHeader):
+            # Shared by every task using the same key and endpoint.
+            return ratelimit.get_bucket(
+                (accesskey, hostHeader),
+                ds0.zAWSRateLimit,
+                ds0.zAWSRateBurst)
 
-            if ds.params['dimension']:
-                dim_name, dim_value = ds.params['dimension'].split('=')
+        @inlineCallbacks
+        def request(hostHeader, static, dynamic, region, service):
+            # Signers are shared and keep pre-encoded query templates,
+            # so only the changing parameters are encoded here.
+            signer = get_signer(
+                accesskey, secretkey, hostHeader,
+                version=ds0.zAWSSignatureVersion,
+                region=region,
+                service=service)
 
-                monitorRequest['Dimensions.member.1.Name'] = dim_name
-                monitorRequest['Dimensions.member.1.Value'] = dim_value
+            getURL = signer.sign(static, dynamic)
 
-            getURL = awsUrlSign(
-                httpVerb,
-                hostHeader,
-                uriRequest,
-                monitorRequest,
-                (accesskey, secretkey))
+            getURL = '%s://%s' % (scheme, getURL)
 
-            getURL = 'http://%s' % getURL
+            bucket = bucket_for(hostHeader)
 
             # Incremental backoff as outlined by AWS.
             # http://aws.amazon.com/articles/1394
@@ -218,127 +891,486 @@ class AmazonCloudWatchDataSourcePlugin(PythonDataSourcePlugin):
                     delay = (random.random() * pow(4, retry)) / 10.0
                     log.debug(
                         '%s (%s): retry %s backoff is %s seconds',
-                        config.id, ds.params['region'], retry, delay)
+                        config.id, region, retry, delay)
 
                     wait = yield sleep(delay)
 
                 try:
-                    log.debug(
-                        '%s (%s): requesting %s %s/%s for %s',
-                        config.id,
-                        ds.params['region'],
-                        ds.params['statistic'],
-                        ds.params['namespace'],
-                        ds.params['metric'],
-                        ds.params['dimension'] or 'region')
+                    if bucket:
+                        yield bucket.acquire()
 
-                    result = yield getPage(getURL)
+                    result = yield httpclient.get_page(getURL)
 
                 except Exception, ex:
-                    code = getattr(ex, 'status', None)
-                    if code in ('500', '503'):
-                        continue
+                    if ratelimit.is_throttling(ex):
+                        log.debug(
+                            '%s (%s): throttled by %s',
+                            config.id, region, hostHeader)
 
-                    raise
+                        if bucket:
+                            bucket.throttled()
+
+                    elif getattr(ex, 'status', None) not in ('500', '503'):
+                        raise
+
+                    # Still failing after the last retry.
+                    if retry == MAX_RETRIES:
+                        raise
 
                 else:
-                    results.append((ds, result))
+                    defer.returnValue(result)
+
+        @inlineCallbacks
+        def list_metrics(region, namespace):
+            listRequest = {}
+            listRequest['Action'] = 'ListMetrics'
+            listRequest['Version'] = '2010-08-01'
+            listRequest['Namespace'] = namespace
+
+            metrics = []
+            next_token = None
+
+            while True:
+                paging = {}
+                if next_token:
+                    paging['NextToken'] = next_token
+
+                result = yield request(
+                    lookup_cwregion(region),
+                    listRequest,
+                    paging,
+                    region,
+                    'monitoring')
+
+                page, next_token = parsers.parse_list_metrics(result)
+                metrics.extend(page)
+
+                if not next_token:
                     break
 
-            if ds.params['metric'] == 'VolumeTotalWriteTime':
-                # Get Volume Status
-                volumeRequest = baseRequest.copy()
-                volumeRequest['Action'] = 'DescribeVolumeStatus'
-                volumeRequest['Version'] = '2013-02-01'
-                volumeRequest['VolumeId.1'] = dim_value
-                hostHeader = 'ec2.amazonaws.com'
+            log.debug(
+                '%s (%s): %s lists %s metrics',
+                config.id, region, namespace, len(metrics))
 
-                getURL = awsUrlSign(
-                        httpVerb,
-                        hostHeader,
-                        uriRequest,
-                        volumeRequest,
-                        [accesskey, secretkey])
+            defer.returnValue(MetricListing(metrics))
 
-                getURL = 'http://%s' % getURL
+        @inlineCallbacks
+        def listed(ds, dimensions):
+            # Listings are shared by every task using the same key and
+            # only refreshed every zAWSCloudWatchListMetricsInterval
+            # hours. A failed listing never prevents collection, and
+            # isn't retried for LIST_METRICS_RETRY seconds.
+            interval = ds0.zAWSCloudWatchListMetricsInterval
+            if not interval or not dimensions:
+                defer.returnValue(True)
 
-                log.debug('Get Volume Information: %s', getURL)
+            region = ds.params['region']
+            namespace = ds.params['namespace']
 
-                result = yield getPage(getURL)
-                results.append(('volumestatus', result))
+            d, _ = shared_request(
+                ('ListMetrics', accesskey, region, namespace),
+                lambda: list_metrics(region, namespace),
+                ttl=interval * 3600,
+                failure_ttl=LIST_METRICS_RETRY)
 
-        defer.returnValue(results)
+            try:
+                listing = yield d
+            except Exception, ex:
+                log.debug(
+                    '%s (%s): unable to list %s metrics: %s',
+                    config.id, region, namespace, result_errmsg(ex))
 
-    def onSuccess(self, results, config):
-        data = self.new_data()
+                defer.returnValue(True)
 
-        for ds, result in results:
+            defer.returnValue(
+                listing.may_exist(ds.params['metric'], dimensions))
 
-            # Only one namespace is used. Mangle the xmlns attribute
-            # to make further processing of the XML simpler.
-            result = result.replace(' xmlns=', ' xmlnamespace=', 1)
+        @inlineCallbacks
+        def fetch(ds):
+            monitorRequest = {}
+            monitorRequest['Action'] = 'GetMetricStatistics'
+            monitorRequest['Version'] = '2010-08-01'
+            monitorRequest['Period'] = cycletime
+            monitorRequest['Namespace'] = ds.params['namespace']
+            monitorRequest['MetricName'] = ds.params['metric']
 
-            try:
-                stats = etree.parse(StringIO(result))
-            except Exception:
-                log.exception(
-                    '%s (%s): error parsing response XML\n%s',
-                    config.id, ds.params['region'], result)
-
-            if ds == 'volumestatus':
-                #Parse volume status events
-                try:
-                    volumes = stats.xpath('//volumeStatusSet/item')
-
-                    for vol in volumes:
-                        volumeID = str(vol.xpath('volumeId[last()]/text()')[0])
-                        volumeStatus = str(vol.xpath('volumeStatus/status/text()')[0])
-
-                        if volumeStatus == 'ok':
-                            data['events'].append({
-                                'component': volumeID,
-                                'device': config.id,
-                                'summary': 'AWS Volume Status: OK',
-                                'severity': ZenEventClasses.Clear,
-                                'eventClass': '/Status',
-                                'eventClassKey': 'AWSVolume',
-                                })
-                        else:
-                            data['events'].append({
-                                'component': volumeID,
-                                'device': config.id,
-                                'summary': "AWS Volume Status: {volumeStatus}".format(
-                                    volumeStatus=volumeStatus),
-                                'severity': ZenEventClasses.Critical,
-                                'eventClass': '/Status',
-                                'eventClassKey': 'AWSVolume',
-                                })
-
-                except IndexError:
-                    continue
+            # All statistics for the metric are fetched in one request.
+            for i, statistic in enumerate(ds.params['statistics'], 1):
+                monitorRequest['Statistics.member.%d' % i] = statistic
+
+            dimensions = parse_dimensions(ds.params['dimension'])
+            for i, (dim_name, dim_value) in enumerate(dimensions, 1):
+                monitorRequest['Dimensions.member.%d.Name' % i] = dim_name
+                monitorRequest['Dimensions.member.%d.Value' % i] = dim_value
+
+            exists = yield listed(ds, dimensions)
+            if not exists:
+                pruned_requests[config.id] += 1
+                log.debug(
+                    '%s (%s): skipping %s/%s for %s. Not listed by '
+                    'ListMetrics (%s skipped total)',
+                    config.id,
+                    ds.params['region'],
+                    ds.params['namespace'],
+                    ds.params['metric'],
+                    ds.params['dimension'],
+                    pruned_requests[config.id])
+
+                defer.returnValue([('collected', ds.component)])
+
+            last = _last_timestamps.get(window_key(config, ds))
+
+            def get():
+                log.debug(
+                    '%s (%s): requesting %s %s/%s for %s',
+                    config.id,
+                    ds.params['region'],
+                    ds.params['statistic'],
+                    ds.params['namespace'],
+                    ds.params['metric'],
+                    ds.params['dimension'] or 'region')
+
+                window = {}
+                window['StartTime'] = iso8601(
+                    seconds_ago=seconds_ago_for(
+                        last, cycletime, ds0.zAWSCloudWatchMaxBackfill))
+
+                window['EndTime'] = iso8601()
+
+                d = request(
+                    lookup_cwregion(ds.params['region']),
+                    monitorRequest,
+                    window,
+                    ds.params['region'],
+                    'monitoring')
+
+                # Parse now so only the datapoints are held, not the
+                # response body.
+                d.addCallback(parsers.parse_metric_statistics)
+                return d
+
+            # Templates often request the same metric for different
+            # datapoints. Identical queries for the same window are
+            # only sent once.
+            key = (
+                accesskey,
+                ds.params['region'],
+                tuple(sorted(monitorRequest.iteritems())),
+                last)
+
+            # Never long enough to reuse the previous cycle's response.
+            d, shared = shared_request(
+                key, get, ttl=min(SHARED_REQUEST_TTL, cycletime / 2))
+            if shared:
+                shared_requests[config.id] += 1
+                log.debug(
+                    '%s (%s): sharing response for %s/%s for %s',
+                    config.id,
+                    ds.params['region'],
+                    ds.params['namespace'],
+                    ds.params['metric'],
+                    ds.params['dimension'] or 'region')
+
+            members = yield d
+
+            sources = aggregate_sources.get(
+                (ds.params['namespace'], ds.params['metric']))
+
+            if sources is not None and ds.component in sources:
+                sources[ds.component] = members
+
+            defer.returnValue([
+                ('collected', ds.component),
+                ('datapoints', datapoints_from_members(config, ds, members)),
+                ])
+
+        def describe_volume_status_page(region, volume_ids, next_token):
+            volumeRequest = {}
+            volumeRequest['Action'] = 'DescribeVolumeStatus'
+            volumeRequest['Version'] = '2013-02-01'
+
+            for i, volume_id in enumerate(volume_ids, 1):
+                volumeRequest['VolumeId.%d' % i] = volume_id
+
+            paging = {}
+            if next_token:
+                paging['NextToken'] = next_token
+
+            return request(
+                lookup_ec2region(region), volumeRequest, paging, region,
+                'ec2')
+
+        @inlineCallbacks
+        def volume_status(region, volume_ids):
+            shared = _volume_status.get((accesskey, region))
+            if shared is None:
+                shared = _volume_status[(accesskey, region)] = \
+                    RegionVolumeStatus()
+
+            request_page = partial(describe_volume_status_page, region)
+
+            statuses = yield shared.get(
+                volume_ids,
+                cycletime,
+                lambda ids: describe_volume_status(
+                    config.id, region, ids, request_page))
+
+            defer.returnValue([('volumestatus', [
+                (x, statuses[x]) for x in volume_ids if x in statuses])])
+
+        # Issue requests in parallel, but never more than the configured
+        # number at once. The per-request retry logic lives in fetch.
+        semaphore = defer.DeferredSemaphore(
+            max(1, int(ds0.zAWSCloudWatchMaxParallel or 1)))
+
+        @inlineCallbacks
+        def aligned_fetch(ds):
+            # Wait for the next period to be published instead of
+            # polling before CloudWatch has data for it.
+            key = window_key(config, ds)
+            delay = publish_delay(
+                key,
+                _last_timestamps.get(key),
+                cycletime,
+                ds.params['publish_period'])
+
+            if delay >= cycletime * MAX_ALIGN_DELAY:
+                skipped_requests[config.id] += 1
+                log.debug(
+                    '%s (%s): skipping %s/%s for %s. Next period due in %ds',
+                    config.id,
+                    ds.params['region'],
+                    ds.params['namespace'],
+                    ds.params['metric'],
+                    ds.params['dimension'] or 'region',
+                    delay)
+
+                defer.returnValue([])
+
+            if delay > 0:
+                yield sleep(delay)
+
+            results = yield semaphore.run(fetch, ds)
+            defer.returnValue(results)
+
+        def isolate(d, components, event_key):
+            # A failed request only affects its own components. Report
+            # the failure in the results instead of failing the task.
+            def failed(result):
+                failed_requests[config.id] += 1
+                log.debug(
+                    '%s: request failed for %s: %s',
+                    config.id, ', '.join(components), result_errmsg(result))
+
+                return [('error', (components, event_key, result))]
+
+            return d.addErrback(failed)
+
+        # Region datasources are computed from the values of the
+        # instances collected for the same metric in this task when
+        # possible, instead of being requested.
+        aggregates = []
+        aggregate_sources = {}
 
+        for ds in config.datasources:
+            components = ds.params.get('aggregate_components')
+            if not components or ds.params['dimension']:
+                continue
+
+            if not all(x in AGGREGATES for x in ds.params['statistics']):
+                continue
+
+            components = set(components)
+            metric_key = (ds.params['namespace'], ds.params['metric'])
+
+            sources = set(
+                x.component for x in config.datasources
+                if x.component in components and
+                (x.params['namespace'], x.params['metric']) == metric_key and
+                set(ds.params['statistics']).issubset(x.params['statistics']))
+
+            if sources:
+                aggregates.append((ds, metric_key, sources))
+                aggregate_sources.setdefault(metric_key, {}).update(
+                    (x, None) for x in sources)
+
+        aggregated = set(id(ds) for ds, _, _ in aggregates)
+
+        deferreds = []
+        for ds in config.datasources:
+            if id(ds) in aggregated:
+                continue
+
+            if ds0.zAWSCloudWatchAlignPolls:
+                d = aligned_fetch(ds)
             else:
-                #Parse cloudwatch metrics
-                try:
-                    timestamp = timestamp_from_cloudwatch(
-                        stats.xpath('//Timestamp[last()]/text()')[0])
+                d = semaphore.run(fetch, ds)
 
-                    value = stats.xpath('//%s[last()]/text()' % (
-                        ds.params['statistic']))[0]
+            deferreds.append(
+                isolate(d, [ds.component], 'awsCloudWatchCollection'))
 
-                except IndexError:
-                    # No value in response. This is usually normal.
-                    continue
+        # Volume status is requested per region for all volumes at once.
+        volume_ids = collections.defaultdict(list)
+        for ds in config.datasources:
+            if ds.params['metric'] != 'VolumeTotalWriteTime':
+                continue
 
-                data['values'][ds.component][ds.datasource] = (value, timestamp)
+            volume_id = dict(
+                parse_dimensions(ds.params['dimension'])).get('VolumeId')
+
+            if volume_id:
+                volume_ids[ds.params['region']].append(volume_id)
+
+        for region, region_volume_ids in sorted(volume_ids.items()):
+            deferreds.append(isolate(
+                volume_status(region, region_volume_ids),
+                region_volume_ids,
+                'awsVolumeStatus'))
+
+        d = defer.DeferredList(deferreds, consumeErrors=True)
+
+        def flatten(results):
+            results = list(chain.from_iterable(r for _, r in results))
+
+            for ds, metric_key, components in aggregates:
+                sources = aggregate_sources[metric_key]
+                members = aggregate_members(
+                    ds.params['statistics'],
+                    [sources[x] for x in sorted(components)])
+
+                log.debug(
+                    '%s (%s): computed %s/%s from %s components',
+                    config.id,
+                    ds.params['region'],
+                    ds.params['namespace'],
+                    ds.params['metric'],
+                    len(components))
+
+                results.append(('collected', ds.component))
+                results.append((
+                    'datapoints',
+                    datapoints_from_members(config, ds, members)))
+
+            # Only fail the whole task if nothing succeeded.
+            if results and all(x == 'error' for x, _ in results):
+                return results[0][1][2]
+
+            return results
+
+        d.addCallback(flatten)
+        return d
+
+    def onSuccess(self, results, config):
+        data = self.new_data()
+        unchanged = 0
+        failed = 0
+
+        # Unchanged events are only sent again after this many seconds.
+        refresh_interval = config.datasources[0].zAWSEventRefreshInterval
+
+        def clear_failure(component, event_key):
+            # Also sent when the state is unknown, so errors reported
+            # before a restart or by another collector are cleared.
+            if not state_changed(
+                    (config.id, component, event_key),
+                    ZenEventClasses.Clear,
+                    refresh_interval):
+                return False
+
+            data['events'].append({
+                'device': config.id,
+                'component': component,
+                'summary': 'AWS: successful collection',
+                'severity': ZenEventClasses.Clear,
+                'eventKey': event_key,
+                'eventClassKey': 'AWSCloudWatchSuccess',
+                })
+
+            return True
+
+        for kind, result in results:
+            if kind == 'error':
+                components, event_key, failure = result
+                failed += 1
+                errmsg = 'AWS: %s' % result_errmsg(failure)
+
+                for component in components:
+                    _event_states[(config.id, component, event_key)] = (
+                        ZenEventClasses.Error, time.time())
+
+                    data['events'].append({
+                        'device': config.id,
+                        'component': component,
+                        'summary': errmsg,
+                        'severity': ZenEventClasses.Error,
+                        'eventKey': event_key,
+                        'eventClassKey': 'AWSCloudWatchError',
+                        })
+
+            elif kind == 'volumestatus':
+                for volumeID, volumeStatus in result:
+                    if not clear_failure(volumeID, 'awsVolumeStatus'):
+                        unchanged += 1
+
+                    if not state_changed(
+                            (config.id, volumeID, 'AWSVolume'),
+                            volumeStatus,
+                            refresh_interval):
+                        unchanged += 1
+                        continue
+
+                    if volumeStatus == 'ok':
+                        data['events'].append({
+                            'component': volumeID,
+                            'device': config.id,
+                            'summary': 'AWS Volume Status: OK',
+                            'severity': ZenEventClasses.Clear,
+                            'eventClass': '/Status',
+                            'eventClassKey': 'AWSVolume',
+                            })
+                    else:
+                        data['events'].append({
+                            'component': volumeID,
+                            'device': config.id,
+                            'summary': "AWS Volume Status: {volumeStatus}".format(
+                                volumeStatus=volumeStatus),
+                            'severity': ZenEventClasses.Critical,
+                            'eventClass': '/Status',
+                            'eventClassKey': 'AWSVolume',
+                            })
+
+            elif kind == 'collected':
+                if not clear_failure(result, 'awsCloudWatchCollection'):
+                    unchanged += 1
+
+            elif kind == 'datapoints':
+                for component, dp_key, value, timestamp in result:
+                    data['values'][component].setdefault(dp_key, []).append(
+                        (value, timestamp))
+
+        if state_changed(
+                (config.id, '', 'awsCloudWatchCollection'),
+                ZenEventClasses.Clear,
+                refresh_interval):
+            data['events'].append({
+                'device': config.id,
+                'summary': 'AWS CloudWatch: successful metrics collection',
+                'severity': ZenEventClasses.Clear,
+                'eventKey': 'awsCloudWatchCollection',
+                'eventClassKey': 'AWSCloudWatchSuccess',
+                })
+        else:
+            unchanged += 1
+
+        if unchanged:
+            log.debug(
+                '%s: not sending %s unchanged events', config.id, unchanged)
+
+        if failed:
+            log.debug(
+                '%s: %s requests failed (%s total)',
+                config.id, failed, failed_requests[config.id])
 
-        data['events'].append({
-            'device': config.id,
-            'summary': 'AWS CloudWatch: successful metrics collection',
-            'severity': ZenEventClasses.Clear,
-            'eventKey': 'awsCloudWatchCollection',
-            'eventClassKey': 'AWSCloudWatchSuccess',
-            })
         return data
 
     def onError(self, result, config):
@@ -346,6 +1378,10 @@ class AmazonCloudWatchDataSourcePlugin(PythonDataSourcePlugin):
         errmsg = 'AWS: %s' % result_errmsg(result)
         log.error('%s: %s', config.id, errmsg)
 
+        # The next successful collection clears this event.
+        _event_states[(config.id, '', 'awsCloudWatchCollection')] = (
+            ZenEventClasses.Error, time.time())
+
         data = self.new_data()
         data['events'].append({
             'device': config.id,
@@ -0,0 +1,248 @@
+##############################################################################
+#
+# Copyright (C) Zenoss, Inc. 2013, all rights reserved.
+#
+# This content is made available according to terms specified in
+# License.zenoss under the directory where your Zenoss product is installed.
+#
+##############################################################################
+
+'''
+HTTP client shared by every collection task in a daemon.
+
+Requests are made through a single Agent backed by a persistent
+HTTPConnectionPool. The pool keeps idle connections per endpoint
+(scheme, host, port) so consecutive requests to the same regional
+endpoint reuse an established connection instead of opening a new one.
+
+HTTPS connections additionally resume the TLS session of the previous
+connection to the same endpoint, so a connection that has to be
+re-established skips the full handshake.
+'''
+
+import logging
+log = logging.getLogger('zen.AWS')
+
+from zope.interface import implements
+
+from twisted.internet import reactor, defer
+from twisted.internet.protocol import Protocol
+from twisted.web import client
+from twisted.web.error import Error
+
+try:
+    from twisted.web.client import Agent, HTTPConnectionPool
+    from twisted.web.client import ResponseDone
+    from twisted.web.http import PotentialDataLoss
+except ImportError:
+    # Persistent connections require Twisted 12.1 or later. Fall back
+    # to one connection per request with getPage on older versions.
+    Agent = HTTPConnectionPool = None
+
+try:
+    from OpenSSL import SSL
+except ImportError:
+    SSL = None
+
+try:
+    from twisted.internet.interfaces import IOpenSSLClientConnectionCreator
+    from twisted.internet.ssl import optionsForClientTLS
+    from twisted.web.iweb import IPolicyForHTTPS
+except ImportError:
+    # Twisted older than 14.0 uses getContext(hostname, port).
+    optionsForClientTLS = IPolicyForHTTPS = None
+
+
+DEFAULT_MAX_PER_HOST = 10
+DEFAULT_IDLE_TIMEOUT = 240
+
+_pool = None
+_agent = None
+
+
+class TLSSessionCache(object):
+    '''
+    HTTPS context factory that resumes TLS sessions per endpoint.
+
+    The most recent session negotiated with each (host, port) is
+    remembered and offered when the next connection to that endpoint
+    is made. Works as an IPolicyForHTTPS on Twisted 14 and later, and
+    as a classic getContext(hostname, port) factory on older releases.
+    '''
+
+    if IPolicyForHTTPS is not None:
+        implements(IPolicyForHTTPS)
+
+    def __init__(self, reuse_sessions=True, trust_root=None):
+        self.reuse_sessions = reuse_sessions
+        self.trust_root = trust_root
+        self._contexts = {}
+        self._sessions = {}
+        self._connections = {}
+
+    def _session(self, key):
+        '''
+        Return the last session negotiated for key or None.
+        '''
+        connection = self._connections.get(key)
+        if connection is not None:
+            session = connection.get_session()
+            if session is not None:
+                self._sessions[key] = session
+
+        return self._sessions.get(key)
+
+    def creatorForNetloc(self, hostname, port):
+        '''
+        Return an IOpenSSLClientConnectionCreator for hostname:port.
+        '''
+        key = (hostname, port)
+
+        # Sessions can only be resumed from the context that created
+        # them, so the underlying options are built once per endpoint.
+        creator = self._contexts.get(key)
+        if creator is None:
+            kwargs = {}
+            if self.trust_root is not None:
+                kwargs['trustRoot'] = self.trust_root
+
+            creator = self._contexts[key] = optionsForClientTLS(
+                hostname.decode('ascii'), **kwargs)
+
+        cache = self
+
+        class SessionResumingCreator(object):
+            implements(IOpenSSLClientConnectionCreator)
+
+            def clientConnectionForTLS(self, tlsProtocol):
+                connection = creator.clientConnectionForTLS(tlsProtocol)
+
+                if cache.reuse_sessions:
+                    session = cache._session(key)
+                    if session is not None:
+                        connection.set_session(session)
+
+                    cache._connections[key] = connection
+
+                return connection
+
+        return SessionResumingCreator()
+
+    def getContext(self, hostname=None, port=None):
+        '''
+        Return an SSL.Context for hostname:port.
+        '''
+        key = (hostname, port)
+
+        context = self._contexts.get(key)
+        if context is not None:
+            return context
+
+        context = SSL.Context(SSL.SSLv23_METHOD)
+        context.set_options(SSL.OP_NO_SSLv2)
+
+        if self.reuse_sessions:
+            def info_callback(connection, where, ret):
+                # Offer the cached session before the ClientHello is
+                # written, and remember the session once negotiated.
+                if where & SSL.SSL_CB_HANDSHAKE_START:
+                    session = self._sessions.get(key)
+                    if session is not None:
+                        connection.set_session(session)
+
+                elif where & SSL.SSL_CB_HANDSHAKE_DONE:
+                    self._sessions[key] = connection.get_session()
+
+            context.set_info_callback(info_callback)
+
+        self._contexts[key] = context
+        return context
+
+
+def configure(max_per_host=None, idle_timeout=None):
+    '''
+    Create the shared connection pool or update its settings.
+
+    The pool is shared by all configs in the process, so the most
+    recently supplied settings win.
+    '''
+    global _pool, _agent
+
+    if HTTPConnectionPool is None:
+        return
+
+    if _pool is None:
+        _pool = HTTPConnectionPool(reactor, persistent=True)
+        _pool.maxPersistentPerHost = DEFAULT_MAX_PER_HOST
+        _pool.cachedConnectionTimeout = DEFAULT_IDLE_TIMEOUT
+
+        if SSL is not None:
+            _agent = Agent(
+                reactor, contextFactory=TLSSessionCache(), pool=_pool)
+        else:
+            _agent = Agent(reactor, pool=_pool)
+
+    if max_per_host:
+        _pool.maxPersistentPerHost = int(max_per_host)
+
+    if idle_timeout:
+        _pool.cachedConnectionTimeout = int(idle_timeout)
+
+
+class _BodyReceiver(Protocol):
+    '''
+    Protocol that accumulates a response body and fires a Deferred with
+    it once the response is complete.
+    '''
+
+    def __init__(self, finished):
+        self.finished = finished
+        self.chunks = []
+
+    def dataReceived(self, data):
+        self.chunks.append(data)
+
+    def connectionLost(self, reason):
+        if reason.check(ResponseDone, PotentialDataLoss):
+            self.finished.callback(''.join(self.chunks))
+        else:
+            self.finished.errback(reason)
+
+
+def request(agent, url, method='GET'):
+    '''
+    Return a Deferred that fires with the body of url fetched by agent.
+
+    Mirrors twisted.web.client.getPage: a non-2xx response errbacks
+    with twisted.web.error.Error carrying the status as a string.
+    '''
+    def read_body(response):
+        finished = defer.Deferred()
+        response.deliverBody(_BodyReceiver(finished))
+
+        if 200 <= response.code < 300:
+            return finished
+
+        def raise_error(body):
+            raise Error(str(response.code), response.phrase, body)
+
+        return finished.addCallback(raise_error)
+
+    d = agent.request(method, url)
+    d.addCallback(read_body)
+    return d
+
+
+def get_page(url, method='GET'):
+    '''
+    Return a Deferred that fires with the body of url.
+
+    Uses the shared connection pool when available.
+    '''
+    if HTTPConnectionPool is None:
+        return client.getPage(url, method=method)
+
+    if _agent is None:
+        configure()
+
+    return request(_agent, url, method=method)
@@ -8,14 +8,21 @@
 ##############################################################################
 
 import collections
+import hashlib
+import time
+
 from itertools import chain
 
+from twisted.internet import defer, threads
+from twisted.internet.defer import inlineCallbacks, returnValue
+
 from Products.DataCollector.plugins.CollectorPlugin import PythonPlugin
 from Products.DataCollector.plugins.DataMaps import ObjectMap, RelationshipMap
 
 from Products.ZenUtils.Utils import prepId
 
-from ZenPacks.zenoss.AWS import MODULE_NAME
+from ZenPacks.zenoss.AWS import MODULE_NAME, parsers
+from ZenPacks.zenoss.AWS.botoauth import use_sigv4
 from ZenPacks.zenoss.AWS.utils import addLocalLibPath
 
 addLocalLibPath()
@@ -24,46 +31,65 @@ from boto.ec2.connection import EC2Connection
 from boto.vpc import VPCConnection
 
 '''
-Models regions, instance types, zones, instances, volumes, VPCs and VPC
+Models regions, instance groups, zones, instances, volumes, VPCs and VPC
 subnets for an Amazon EC2 account.
 '''
 
+# Hash of each relationship map last applied, keyed by (device id,
+# relname, compname).
+_relmap_hashes = {}
+
+# (model token, {key: hash}) of the relationship maps last returned per
+# device id. Recorded in _relmap_hashes once the device has the token,
+# showing the maps were applied.
+_pending_hashes = {}
+
+# Time of the last model returning every relationship map, per device id.
+_full_models = {}
+
+# DescribeInstances and DescribeVolumes are requested one page at a time
+# so only one page of responses and records is held in memory. Paging
+# needs a newer API version than boto's default.
+PAGED_API_VERSION = '2014-10-01'
+INSTANCES_PAGE_SIZE = 1000
+VOLUMES_PAGE_SIZE = 500
+
 
 class EC2(PythonPlugin):
     deviceProperties = PythonPlugin.deviceProperties + (
         'ec2accesskey',
         'ec2secretkey',
+        'zAWSSignatureVersion',
+        'zAWSModelerMaxParallel',
+        'zAWSModelerFullInterval',
+        'model_token',
         )
 
     def collect(self, device, log):
-        return True
-
-    def process(self, device, results, log):
-        log.info(
-            'Modeler %s processing data for device %s',
-            self.name(), device.id)
-
         accesskey = getattr(device, 'ec2accesskey', None)
         if not accesskey:
-            log.error('%s: EC2 access key not set. Not discovering.')
+            log.error(
+                '%s: EC2 access key not set. Not discovering.', device.id)
             return
 
         secretkey = getattr(device, 'ec2secretkey', None)
         if not secretkey:
-            log.error('%s: EC2 secret key not set. Not discovering.')
+            log.error(
+                '%s: EC2 secret key not set. Not discovering.', device.id)
             return
 
-        maps = collections.OrderedDict([
-            ('regions', []),
-            ('instance types', []),
-            ('zones', []),
-            ('VPCs', []),
-            ('VPC subnets', []),
-            ('instances', []),
-            ('volumes', []),
-            ('account', []),
-            ])
+        return self.collect_regions(device, log, accesskey, secretkey)
 
+    @inlineCallbacks
+    def collect_regions(self, device, log, accesskey, secretkey):
+        '''
+        Return a Deferred that fires with the EC2 API results for every
+        region.
+
+        boto blocks, so each call is made in the reactor's thread pool
+        with at most zAWSModelerMaxParallel calls running at once. The
+        reactor stays free to model other devices in the meantime.
+        '''
         instance_filters = {
             'instance-state-name': [
                 'pending',
@@ -74,63 +100,264 @@ class EC2(PythonPlugin):
                 ],
             }
 
-        ec2conn = EC2Connection(accesskey, secretkey)
-
-        region_oms = []
-        for region in ec2conn.get_all_regions():
+        if getattr(device, 'zAWSSignatureVersion', 2) == 4:
+            connect = use_sigv4
+        else:
+            connect = lambda conn: conn
+
+        # Connections are made per call. They are not shared between
+        # threads.
+        def ec2(region):
+            return connect(EC2Connection(accesskey, secretkey, region=region))
+
+        def vpc(region):
+            return connect(VPCConnection(accesskey, secretkey, region=region))
+
+        # Responses are parsed into records holding only the fields
+        # used here instead of boto's full object model.
+        def zones(region):
+            return list(chain.from_iterable(paged(
+                ec2(region),
+                'DescribeAvailabilityZones',
+                parsers.parse_zones)))
+
+        def vpcs(region):
+            return list(chain.from_iterable(paged(
+                vpc(region), 'DescribeVpcs', parsers.parse_vpcs)))
+
+        def vpc_subnets(region):
+            return list(chain.from_iterable(paged(
+                vpc(region), 'DescribeSubnets', parsers.parse_subnets)))
+
+        # Instances and volumes are turned into ObjectMap data a page
+        # at a time as the pages arrive.
+        def instances(region):
+            return list(chain.from_iterable(
+                instances_data(page) for page in paged(
+                    ec2(region),
+                    'DescribeInstances',
+                    parsers.parse_instances,
+                    page_size=INSTANCES_PAGE_SIZE,
+                    filters=instance_filters)))
+
+        def volumes(region):
+            return list(chain.from_iterable(
+                volumes_data(page) for page in paged(
+                    ec2(region),
+                    'DescribeVolumes',
+                    parsers.parse_volumes,
+                    page_size=VOLUMES_PAGE_SIZE)))
+
+        region_calls = (
+            ('zones', zones),
+            ('VPCs', vpcs),
+            ('VPC subnets', vpc_subnets),
+            ('instances', instances),
+            ('volumes', volumes),
+            )
+
+        regions = yield threads.deferToThread(
+            lambda: connect(
+                EC2Connection(accesskey, secretkey)).get_all_regions())
+
+        semaphore = defer.DeferredSemaphore(max(1, int(
+            getattr(device, 'zAWSModelerMaxParallel', 10) or 1)))
+
+        calls = []
+        deferreds = []
+        for region in regions:
             region_id = prepId(region.name)
 
-            region_oms.append(ObjectMap(data={
-                'id': region_id,
-                'title': region.name,
-                }))
-
-            ec2regionconn = EC2Connection(accesskey, secretkey, region=region)
-            vpcregionconn = VPCConnection(accesskey, secretkey, region=region)
-
-            # Zones
-            maps['zones'].append(
-                zones_rm(
-                    region_id,
-                    ec2regionconn.get_all_zones()))
-
-            # VPCs
-            maps['VPCs'].append(
-                vpcs_rm(
-                    region_id,
-                    vpcregionconn.get_all_vpcs()))
-
-            # VPC Subnets
-            maps['VPC subnets'].append(
-                vpc_subnets_rm(
-                    region_id,
-                    vpcregionconn.get_all_subnets()))
-
-            # Instances
-            maps['instances'].append(
-                instances_rm(
-                    region_id,
-                    ec2regionconn.get_all_instances(
-                        filters=instance_filters)))
-
-            # Volumes
-            maps['volumes'].append(
-                volumes_rm(
-                    region_id,
-                    ec2regionconn.get_all_volumes()))
+            for name, call in region_calls:
+                calls.append((name, region_id))
+                deferreds.append(semaphore.run(
+                    threads.deferToThread, call, region))
+
+        # Results are in call order, so maps are built in the same
+        # order as they would be one call at a time.
+        d = defer.DeferredList(
+            deferreds, fireOnOneErrback=True, consumeErrors=True)
+
+        d.addErrback(lambda failure: failure.value.subFailure)
+
+        results = yield d
+
+        returnValue({
+            'regions': [(prepId(x.name), x.name) for x in regions],
+            'calls': [
+                (name, region_id, result)
+                for (name, region_id), (_, result) in zip(calls, results)],
+            })
+
+    def process(self, device, results, log):
+        log.info(
+            'Modeler %s processing data for device %s',
+            self.name(), device.id)
+
+        if not results:
+            return
+
+        maps = collections.OrderedDict([
+            ('regions', []),
+            ('instance groups', []),
+            ('zones', []),
+            ('VPCs', []),
+            ('VPC subnets', []),
+            ('instances', []),
+            ('volumes', []),
+            ('account', []),
+            ])
+
+        relmap_functions = {
+            'zones': [('zones', zones_rm)],
+            'VPCs': [('VPCs', vpcs_rm)],
+            'VPC subnets': [('VPC subnets', vpc_subnets_rm)],
+            'instances': [
+                ('instances', instances_rm),
+                ('instance groups', instance_groups_rm),
+                ],
+            'volumes': [('volumes', volumes_rm)],
+            }
+
+        for name, region_id, result in results['calls']:
+            for key, relmap_function in relmap_functions[name]:
+                maps[key].append(relmap_function(region_id, result))
 
         # Regions
         maps['regions'].append(RelationshipMap(
             relname='regions',
             modname=MODULE_NAME['EC2Region'],
-            objmaps=region_oms))
+            objmaps=[
+                ObjectMap(data={'id': region_id, 'title': title})
+                for region_id, title in results['regions']]))
 
         # Trigger discovery of instance guest devices.
         maps['account'].append(ObjectMap(data={
             'setDiscoverGuests': True,
             }))
 
-        return list(chain.from_iterable(maps.itervalues()))
+        return changed_maps(
+            device,
+            list(chain.from_iterable(maps.itervalues())),
+            log)
+
+
+# CloudWatch aggregate dimensions for instance groups, and the instance
+# ObjectMap attribute holding each.
+INSTANCE_GROUP_DIMENSIONS = {
+    'InstanceType': 'instance_type',
+    'ImageId': 'image_id',
+    }
+
+
+def relmap_hash(relmap):
+    '''
+    Return a hash of relmap's content that doesn't depend on the order
+    of its object maps.
+    '''
+    objmaps = sorted(sorted(x.items()) for x in relmap.maps)
+
+    return hashlib.sha1(repr((
+        relmap.relname,
+        relmap.compname,
+        relmap.modname,
+        objmaps))).hexdigest()
+
+
+def changed_maps(device, datamaps, log, now=None):
+    '''
+    Return datamaps without the relationship maps that are unchanged
+    since they were last applied to device.
+
+    An ObjectMap setting the device's model_token is added last. The
+    maps returned are only known to be applied once the device has that
+    token. If it doesn't by the next model, every map is returned.
+
+    Every map is also returned once every zAWSModelerFullInterval hours,
+    or every time if it is 0, so changes made outside of modeling are
+    eventually corrected.
+    '''
+    if now is None:
+        now = time.time()
+
+    token, pending = _pending_hashes.pop(device.id, (None, {}))
+    if token is not None:
+        if token == getattr(device, 'model_token', None):
+            _relmap_hashes.update(pending)
+        else:
+            log.info(
+                '%s: previous model was not applied. Sending every map',
+                device.id)
+
+            for key in _relmap_hashes.keys():
+                if key[0] == device.id:
+                    del _relmap_hashes[key]
+
+    interval = getattr(device, 'zAWSModelerFullInterval', 24) or 0
+    full = now - _full_models.get(device.id, 0) >= interval * 3600
+    if full:
+        _full_models[device.id] = now
+
+    changed = []
+    pending = {}
+    for datamap in datamaps:
+        if not isinstance(datamap, RelationshipMap):
+            changed.append(datamap)
+            continue
+
+        key = (device.id, datamap.relname, datamap.compname)
+        content_hash = relmap_hash(datamap)
+
+        if full or _relmap_hashes.get(key) != content_hash:
+            pending[key] = content_hash
+            changed.append(datamap)
+
+    token = repr(now)
+    _pending_hashes[device.id] = (token, pending)
+    changed.append(ObjectMap(data={'model_token': token}))
+
+    if not full:
+        log.info(
+            '%s: %s of %s relationship maps unchanged since last model',
+            device.id,
+            len(datamaps) - len(changed) + 1,
+            len([x for x in datamaps if isinstance(x, RelationshipMap)]))
+
+    return changed
+
+
+def paged(connection, action, parse, page_size=None, filters=None):
+    '''
+    Yield the records parsed by parse from each page of results for
+    action, following NextToken until the last page.
+
+    Requests are made and signed by connection, but the response body
+    is handed to parse instead of boto's object model.
+    '''
+    connection.APIVersion = PAGED_API_VERSION
+
+    params = {}
+    if page_size:
+        params['MaxResults'] = page_size
+
+    if filters:
+        connection.build_filter_params(params, filters)
+
+    while True:
+        response = connection.make_request(action, params, '/', 'POST')
+        body = response.read()
+
+        if response.status != 200 or not body:
+            raise connection.ResponseError(
+                response.status, response.reason, body)
+
+        records, next_token = parse(body)
+        yield records
+
+        if not next_token:
+            break
+
+        params['NextToken'] = next_token
 
 
 def name_or(tags, default):
@@ -155,7 +382,7 @@ def to_boolean(string):
 
 def zones_rm(region_id, zones):
     '''
-    Return zones RelationshipMap given region_id and ZoneInfo ResultSet.
+    Return zones RelationshipMap given region_id and zone records.
     '''
     zone_data = []
     for zone in zones:
@@ -174,7 +401,7 @@ def zones_rm(region_id, zones):
 
 def vpcs_rm(region_id, vpcs):
     '''
-    Return vpcs RelationshipMap given region_id and VPCInfo ResultSet.
+    Return vpcs RelationshipMap given region_id and VPC records.
     '''
     vpc_data = []
     for vpc in vpcs:
@@ -200,8 +427,8 @@ def vpcs_rm(region_id, vpcs):
 
 def vpc_subnets_rm(region_id, subnets):
     '''
-    Return vpc_subnets RelationshipMap given region_id and a SubnetInfo
-    ResultSet.
+    Return vpc_subnets RelationshipMap given region_id and subnet
+    records.
     '''
     vpc_subnet_data = []
     for subnet in subnets:
@@ -224,13 +451,12 @@ def vpc_subnets_rm(region_id, subnets):
         objmaps=vpc_subnet_data)
 
 
-def instances_rm(region_id, reservations):
+def instances_data(instances):
     '''
-    Return instances RelationshipMap given region_id and an InstanceInfo
-    ResultSet.
+    Return a list of instance ObjectMap data given instance records.
     '''
     instance_data = []
-    for instance in chain.from_iterable(r.instances for r in reservations):
+    for instance in instances:
         zone_id = prepId(instance.placement) if instance.placement else None
         subnet_id = prepId(instance.subnet_id) if instance.subnet_id else None
 
@@ -250,6 +476,14 @@ def instances_rm(region_id, reservations):
             'setVPCSubnetId': subnet_id,
             })
 
+    return instance_data
+
+
+def instances_rm(region_id, instance_data):
+    '''
+    Return instances RelationshipMap given region_id and instance
+    ObjectMap data.
+    '''
     return RelationshipMap(
         compname='regions/%s' % region_id,
         relname='instances',
@@ -257,10 +491,41 @@ def instances_rm(region_id, reservations):
         objmaps=instance_data)
 
 
-def volumes_rm(region_id, volumes):
+def instance_groups_rm(region_id, instance_data):
+    '''
+    Return instance_groups RelationshipMap given region_id and instance
+    ObjectMap data.
+
+    One group is modeled for each instance type and each image in use
+    in the region.
+    '''
+    counts = collections.Counter()
+    for instance in instance_data:
+        for dimension_name, attr in INSTANCE_GROUP_DIMENSIONS.iteritems():
+            value = instance.get(attr)
+            if value:
+                counts[(dimension_name, value)] += 1
+
+    instance_group_data = []
+    for (dimension_name, value), count in sorted(counts.iteritems()):
+        instance_group_data.append({
+            'id': prepId('%s-%s' % (dimension_name, value)),
+            'title': '%s %s' % (dimension_name, value),
+            'dimension_name': dimension_name,
+            'dimension_value': value,
+            'instance_count': count,
+            })
+
+    return RelationshipMap(
+        compname='regions/%s' % region_id,
+        relname='instance_groups',
+        modname=MODULE_NAME['EC2InstanceGroup'],
+        objmaps=instance_group_data)
+
+
+def volumes_data(volumes):
     '''
-    Return volumes RelationshipMap given region_id and a VolumeInfo
-    ResultSet.
+    Return a list of volume ObjectMap data given volume records.
     '''
     volume_data = []
     for volume in volumes:
@@ -274,7 +539,7 @@ def volumes_rm(region_id, volumes):
             'title': name_or(volume.tags, volume.id),
             'volume_type': volume.type,
             'create_time': volume.create_time,
-            'size': volume.size / (1024 ** 3),
+            'size': volume.size * (1024 ** 3),
             'iops': volume.iops,
             'status': volume.status,
             'attach_data_status': volume.attach_data.status,
@@ -283,6 +548,14 @@ def volumes_rm(region_id, volumes):
             'setZoneId': volume.zone,
             })
 
+    return volume_data
+
+
+def volumes_rm(region_id, volume_data):
+    '''
+    Return volumes RelationshipMap given region_id and volume ObjectMap
+    data.
+    '''
     return RelationshipMap(
         compname='regions/%s' % region_id,
         relname='volumes',
@@ -0,0 +1,504 @@
+##############################################################################
+#
+# Copyright (C) Zenoss, Inc. 2013, all rights reserved.
+#
+# This content is made available according to terms specified in
+# License.zenoss under the directory where your Zenoss product is installed.
+#
+##############################################################################
+
+'''
+Parsers for AWS query API responses handled during collection and
+modeling.
+
+Responses are parsed straight from the response body with precompiled,
+namespace-aware XPath expressions. The namespace is taken from the
+document element, so responses for any API version are handled without
+rewriting the body.
+
+Inventory responses used for modeling are parsed incrementally into
+compact records holding only the fields the modeler uses.
+'''
+
+import calendar
+
+from cStringIO import StringIO
+from operator import itemgetter
+
+from lxml import etree
+
+
+DATAPOINTS_PATH = (
+    '/x:GetMetricStatisticsResponse'
+    '/x:GetMetricStatisticsResult'
+    '/x:Datapoints'
+    '/x:member')
+
+VOLUME_STATUS_PATH = (
+    '/x:DescribeVolumeStatusResponse'
+    '/x:volumeStatusSet'
+    '/x:item')
+
+LIST_METRICS_PATH = (
+    '/x:ListMetricsResponse'
+    '/x:ListMetricsResult'
+    '/x:Metrics'
+    '/x:member')
+
+NEXT_TOKEN_PATH = '/*/x:nextToken/text()'
+
+LIST_METRICS_NEXT_TOKEN_PATH = (
+    '/x:ListMetricsResponse'
+    '/x:ListMetricsResult'
+    '/x:NextToken/text()')
+
+_xpaths = {}
+_day_seconds = {}
+
+
+def xpath(path, namespace):
+    '''
+    Return a compiled XPath for path with the x prefix bound to
+    namespace. Compiled expressions are cached.
+    '''
+    key = (path, namespace)
+
+    compiled = _xpaths.get(key)
+    if compiled is None:
+        compiled = _xpaths[key] = etree.XPath(
+            path, namespaces={'x': namespace})
+
+    return compiled
+
+
+def namespace_of(element):
+    '''
+    Return the namespace URI of element or an empty string.
+    '''
+    tag = element.tag
+    if tag[0] == '{':
+        return tag[1:tag.index('}')]
+
+    return ''
+
+
+def timestamp_from_iso8601(value):
+    '''
+    Return UNIX timestamp given an ISO-8601 UTC string such as
+    2013-03-06T18:20:00Z or 2013-03-06T18:20:00.000Z.
+
+    Raises ValueError if value can't be parsed.
+    '''
+    if len(value) < 20 or value[10] != 'T' or value[-1] != 'Z':
+        raise ValueError('not an ISO-8601 UTC timestamp: %r' % value)
+
+    date = value[:10]
+
+    day = _day_seconds.get(date)
+    if day is None:
+        day = _day_seconds[date] = calendar.timegm((
+            int(value[0:4]), int(value[5:7]), int(value[8:10]),
+            0, 0, 0, 0, 0, 0))
+
+    return day + (
+        int(value[11:13]) * 3600 +
+        int(value[14:16]) * 60 +
+        int(value[17:19]))
+
+
+def parse_metric_statistics(body):
+    '''
+    Return a list of (timestamp, {statistic: value}) tuples, oldest
+    first, given a GetMetricStatistics response body. Members without
+    a valid timestamp are skipped.
+    '''
+    root = etree.fromstring(body)
+    namespace = namespace_of(root)
+    skip = len(namespace) + 2 if namespace else 0
+
+    points = []
+    for member in xpath(DATAPOINTS_PATH, namespace)(root):
+        timestamp = None
+        values = {}
+
+        for child in member:
+            name = child.tag[skip:]
+            if name == 'Timestamp':
+                try:
+                    timestamp = timestamp_from_iso8601(child.text)
+                except (TypeError, ValueError):
+                    break
+            elif name != 'Unit':
+                values[name] = child.text
+
+        if timestamp is not None:
+            points.append((timestamp, values))
+
+    points.sort(key=itemgetter(0))
+    return points
+
+
+def parse_volume_status(body):
+    '''
+    Return ([(volume_id, status), ...], next_token) given a
+    DescribeVolumeStatus response body. next_token is None on the last
+    page.
+    '''
+    root = etree.fromstring(body)
+    namespace = namespace_of(root)
+    skip = len(namespace) + 2 if namespace else 0
+
+    statuses = []
+    for item in xpath(VOLUME_STATUS_PATH, namespace)(root):
+        volume_id = None
+        status = None
+
+        for child in item:
+            name = child.tag[skip:]
+            if name == 'volumeId':
+                volume_id = child.text
+            elif name == 'volumeStatus':
+                for grandchild in child:
+                    if grandchild.tag[skip:] == 'status':
+                        status = grandchild.text
+                        break
+
+        if volume_id and status:
+            statuses.append((volume_id, status))
+
+    next_token = xpath(NEXT_TOKEN_PATH, namespace)(root)
+
+    return statuses, str(next_token[0]) if next_token else None
+
+
+def parse_list_metrics(body):
+    '''
+    Return ([(metric_name, dimensions), ...], next_token) given a
+    ListMetrics response body. dimensions is a sorted tuple of
+    (name, value) tuples. next_token is None on the last page.
+    '''
+    root = etree.fromstring(body)
+    namespace = namespace_of(root)
+    skip = len(namespace) + 2 if namespace else 0
+
+    metrics = []
+    for member in xpath(LIST_METRICS_PATH, namespace)(root):
+        metric_name = None
+        dimensions = []
+
+        for child in member:
+            name = child.tag[skip:]
+            if name == 'MetricName':
+                metric_name = child.text
+            elif name == 'Dimensions':
+                for dimension in child:
+                    values = dict(
+                        (x.tag[skip:], x.text) for x in dimension)
+
+                    dimensions.append(
+                        (values.get('Name'), values.get('Value')))
+
+        if metric_name:
+            metrics.append((metric_name, tuple(sorted(dimensions))))
+
+    next_token = xpath(LIST_METRICS_NEXT_TOKEN_PATH, namespace)(root)
+
+    return metrics, str(next_token[0]) if next_token else None
+
+
+class Record(object):
+    '''
+    Base class for inventory records. Fields default to None.
+    '''
+
+    __slots__ = ()
+
+    def __init__(self):
+        for name in self.__slots__:
+            setattr(self, name, None)
+
+
+class ZoneRecord(Record):
+    __slots__ = ('name', 'state')
+
+
+class VPCRecord(Record):
+    __slots__ = ('id', 'tags', 'cidr_block', 'state')
+
+
+class SubnetRecord(Record):
+    __slots__ = (
+        'id', 'tags', 'available_ip_address_count', 'cidr_block',
+        'defaultForAz', 'mapPublicIpOnLaunch', 'state', 'vpc_id',
+        'availability_zone')
+
+
+class InstanceRecord(Record):
+    __slots__ = (
+        'id', 'tags', 'public_dns_name', 'private_ip_address', 'image_id',
+        'instance_type', 'launch_time', 'state', 'platform', 'monitored',
+        'placement', 'subnet_id')
+
+
+class AttachmentRecord(Record):
+    __slots__ = ('instance_id', 'status', 'device')
+
+
+class VolumeRecord(Record):
+    __slots__ = (
+        'id', 'tags', 'type', 'create_time', 'size', 'iops', 'status',
+        'attach_data', 'zone')
+
+
+# Record field for each element holding a plain value, and the function
+# converting its text, if any.
+ZONE_FIELDS = {
+    'zoneName': ('name', None),
+    'zoneState': ('state', None),
+    }
+
+VPC_FIELDS = {
+    'vpcId': ('id', None),
+    'cidrBlock': ('cidr_block', None),
+    'state': ('state', None),
+    }
+
+SUBNET_FIELDS = {
+    'subnetId': ('id', None),
+    'availableIpAddressCount': ('available_ip_address_count', int),
+    'cidrBlock': ('cidr_block', None),
+    'defaultForAz': ('defaultForAz', None),
+    'mapPublicIpOnLaunch': ('mapPublicIpOnLaunch', None),
+    'state': ('state', None),
+    'vpcId': ('vpc_id', None),
+    'availabilityZone': ('availability_zone', None),
+    }
+
+INSTANCE_FIELDS = {
+    'instanceId': ('id', None),
+    'dnsName': ('public_dns_name', None),
+    'publicDnsName': ('public_dns_name', None),
+    'privateIpAddress': ('private_ip_address', None),
+    'imageId': ('image_id', None),
+    'instanceType': ('instance_type', None),
+    'launchTime': ('launch_time', None),
+    'platform': ('platform', None),
+    'subnetId': ('subnet_id', None),
+    }
+
+VOLUME_FIELDS = {
+    'volumeId': ('id', None),
+    'volumeType': ('type', None),
+    'createTime': ('create_time', None),
+    'size': ('size', int),
+    'iops': ('iops', int),
+    'status': ('status', None),
+    'availabilityZone': ('zone', None),
+    }
+
+ATTACHMENT_FIELDS = {
+    'instanceId': ('instance_id', None),
+    'status': ('status', None),
+    'device': ('device', None),
+    }
+
+
+def child_text(element, name, skip):
+    '''
+    Return the text of element's first child named name or None.
+    '''
+    for child in element:
+        if child.tag[skip:] == name:
+            return child.text
+
+
+def tags_of(element, skip):
+    '''
+    Return {key: value} given a tagSet element.
+    '''
+    tags = {}
+    for item in element:
+        key = child_text(item, 'key', skip)
+        if key is not None:
+            tags[key] = child_text(item, 'value', skip) or ''
+
+    return tags
+
+
+def fill_record(record, element, skip, fields):
+    '''
+    Set record's plain fields from element's children. Return a list of
+    (name, child) tuples for the children that aren't plain fields.
+    '''
+    others = []
+    for child in element:
+        name = child.tag[skip:]
+
+        field = fields.get(name)
+        if field is None:
+            others.append((name, child))
+            continue
+
+        attr, convert = field
+        value = child.text
+        if convert is not None and value is not None:
+            value = convert(value)
+
+        setattr(record, attr, value)
+
+    return others
+
+
+def zone_record(element, skip):
+    record = ZoneRecord()
+    fill_record(record, element, skip, ZONE_FIELDS)
+    return record
+
+
+def vpc_record(element, skip):
+    record = VPCRecord()
+    record.tags = {}
+
+    for name, child in fill_record(record, element, skip, VPC_FIELDS):
+        if name == 'tagSet':
+            record.tags = tags_of(child, skip)
+
+    return record
+
+
+def subnet_record(element, skip):
+    record = SubnetRecord()
+    record.tags = {}
+
+    for name, child in fill_record(record, element, skip, SUBNET_FIELDS):
+        if name == 'tagSet':
+            record.tags = tags_of(child, skip)
+
+    return record
+
+
+def instance_record(element, skip):
+    record = InstanceRecord()
+    record.tags = {}
+    record.monitored = False
+
+    for name, child in fill_record(record, element, skip, INSTANCE_FIELDS):
+        if name == 'tagSet':
+            record.tags = tags_of(child, skip)
+        elif name == 'instanceState':
+            record.state = child_text(child, 'name', skip)
+        elif name == 'placement':
+            record.placement = child_text(child, 'availabilityZone', skip)
+        elif name == 'monitoring':
+            record.monitored = child_text(child, 'state', skip) == 'enabled'
+
+    return record
+
+
+def volume_record(element, skip):
+    record = VolumeRecord()
+    record.tags = {}
+    record.attach_data = AttachmentRecord()
+
+    for name, child in fill_record(record, element, skip, VOLUME_FIELDS):
+        if name == 'tagSet':
+            record.tags = tags_of(child, skip)
+        elif name == 'attachmentSet' and len(child):
+            fill_record(record.attach_data, child[0], skip, ATTACHMENT_FIELDS)
+
+    return record
+
+
+def parse_records(body, path, record):
+    '''
+    Return ([record, ...], next_token) given an EC2 response body.
+
+    path is the tuple of element names leading from the document
+    element to each item. record is called with each item element and
+    the length of its namespace prefix once the item has been parsed.
+    Items are discarded as soon as they are turned into records, so
+    the parsed document never holds more than one item.
+    '''
+    records = []
+    next_token = None
+
+    depth = len(path) + 1
+    last = path[-1]
+    names = []
+    skip = None
+
+    context = etree.iterparse(StringIO(body), events=('start', 'end'))
+    for event, element in context:
+        if event == 'start':
+            if skip is None:
+                namespace = namespace_of(element)
+                skip = len(namespace) + 2 if namespace else 0
+
+            names.append(element.tag[skip:])
+            continue
+
+        level = len(names)
+        if level == depth and names[-1] == last and \
+                tuple(names[1:]) == path:
+            records.append(record(element, skip))
+
+            element.clear()
+            while element.getprevious() is not None:
+                del element.getparent()[0]
+
+        elif level == 2 and names[-1] == 'nextToken':
+            next_token = element.text
+
+        elif 1 < level < depth and tuple(names[1:]) == path[:level - 1]:
+            # Containers of items, such as reservations, are discarded
+            # once all of their items have been turned into records.
+            element.clear()
+            while element.getprevious() is not None:
+                del element.getparent()[0]
+
+        names.pop()
+
+    return records, str(next_token) if next_token else None
+
+
+def parse_zones(body):
+    '''
+    Return ([ZoneRecord, ...], None) given a DescribeAvailabilityZones
+    response body.
+    '''
+    return parse_records(body, ('availabilityZoneInfo', 'item'), zone_record)
+
+
+def parse_vpcs(body):
+    '''
+    Return ([VPCRecord, ...], next_token) given a DescribeVpcs response
+    body.
+    '''
+    return parse_records(body, ('vpcSet', 'item'), vpc_record)
+
+
+def parse_subnets(body):
+    '''
+    Return ([SubnetRecord, ...], next_token) given a DescribeSubnets
+    response body.
+    '''
+    return parse_records(body, ('subnetSet', 'item'), subnet_record)
+
+
+def parse_instances(body):
+    '''
+    Return ([InstanceRecord, ...], next_token) given a DescribeInstances
+    response body. Instances of every reservation are returned.
+    '''
+    return parse_records(
+        body,
+        ('reservationSet', 'item', 'instancesSet', 'item'),
+        instance_record)
+
+
+def parse_volumes(body):
+    '''
+    Return ([VolumeRecord, ...], next_token) given a DescribeVolumes
+    response body.
+    '''
+    return parse_records(body, ('volumeSet', 'item'), volume_record)
@@ -0,0 +1,142 @@
+##############################################################################
+#
+# Copyright (C) Zenoss, Inc. 2013, all rights reserved.
+#
+# This content is made available according to terms specified in
+# License.zenoss under the directory where your Zenoss product is installed.
+#
+##############################################################################
+
+'''
+Process-wide rate limiting for AWS API requests.
+
+Every collection task in a daemon shares one token bucket per
+(access key, endpoint). Requests wait for a token before being sent,
+which spreads the burst of requests made at the top of each cycle
+instead of letting them all hit the endpoint at once.
+'''
+
+import logging
+log = logging.getLogger('zen.AWS')
+
+from collections import deque
+
+from twisted.internet import defer
+
+
+class TokenBucket(object):
+    '''
+    Token bucket that hands out tokens as Deferreds.
+
+    Tokens are added continuously at rate per second up to burst.
+    Waiters are served in the order they called acquire.
+    '''
+
+    def __init__(self, rate, burst, clock=None):
+        if clock is None:
+            from twisted.internet import reactor as clock
+
+        self.clock = clock
+        self.rate = float(rate)
+        self.burst = float(burst)
+        self.tokens = self.burst
+        self.updated = clock.seconds()
+        self.waiting = deque()
+        self._call = None
+
+    def configure(self, rate, burst):
+        '''
+        Update rate and burst without losing queued waiters.
+        '''
+        self._refill()
+        self.rate = float(rate)
+        self.burst = float(burst)
+        self.tokens = min(self.tokens, self.burst)
+
+    def _refill(self):
+        now = self.clock.seconds()
+        elapsed = now - self.updated
+        self.updated = now
+
+        if elapsed > 0:
+            self.tokens = min(self.burst, self.tokens + elapsed * self.rate)
+
+    def acquire(self):
+        '''
+        Return a Deferred that fires when a token is available.
+        '''
+        self._refill()
+
+        if not self.waiting and self.tokens >= 1:
+            self.tokens -= 1
+            return defer.succeed(None)
+
+        d = defer.Deferred()
+        self.waiting.append(d)
+        self._schedule()
+        return d
+
+    def throttled(self):
+        '''
+        Empty the bucket after the endpoint reported throttling.
+        '''
+        self._refill()
+        self.tokens = min(self.tokens, 0.0)
+
+    def _schedule(self):
+        if self._call is not None and self._call.active():
+            return
+
+        delay = max(0.0, (1 - self.tokens) / self.rate)
+        self._call = self.clock.callLater(delay, self._release)
+
+    def _release(self):
+        self._call = None
+        self._refill()
+
+        while self.waiting and self.tokens >= 1:
+            self.tokens -= 1
+            self.waiting.popleft().callback(None)
+
+        if self.waiting:
+            self._schedule()
+
+
+_buckets = {}
+
+
+def get_bucket(key, rate, burst):
+    '''
+    Return the shared TokenBucket for key, or None if rate is not
+    positive. Existing buckets are updated with rate and burst.
+    '''
+    try:
+        rate = float(rate or 0)
+        burst = max(1.0, float(burst or 1))
+    except (TypeError, ValueError):
+        return None
+
+    if rate <= 0:
+        return None
+
+    bucket = _buckets.get(key)
+    if bucket is None:
+        bucket = _buckets[key] = TokenBucket(rate, burst)
+    elif bucket.rate != rate or bucket.burst != burst:
+        bucket.configure(rate, burst)
+
+    return bucket
+
+
+def is_throttling(error):
+    '''
+    Return True if error is an AWS throttling response.
+    '''
+    if str(getattr(error, 'status', '')) not in ('400', '503'):
+        return False
+
+    body = getattr(error, 'response', None) or ''
+
+    return (
+        '<Code>Throttling</Code>' in body or
+        '<Code>RequestLimitExceeded</Code>' in body)
@@ -628,6 +628,80 @@ ZC.EC2VPCSubnetPanel = Ext.extend(ZC.EC2ComponentGridPanel, {
 Ext.reg('EC2VPCSubnetPanel', ZC.EC2VPCSubnetPanel);
 
 
+ZC.EC2InstanceGroupPanel = Ext.extend(ZC.EC2ComponentGridPanel, {
+    subComponentGridPanel: false,
+
+    constructor: function(config) {
+        config = Ext.applyIf(config||{}, {
+            autoExpandColumn: 'name',
+            componentType: 'EC2InstanceGroup',
+            fields: [
+                {name: 'uid'},
+                {name: 'name'},
+                {name: 'status'},
+                {name: 'severity'},
+                {name: 'usesMonitorAttribute'},
+                {name: 'monitor'},
+                {name: 'monitored'},
+                {name: 'locking'},
+                {name: 'region'},
+                {name: 'dimension_name'},
+                {name: 'dimension_value'},
+                {name: 'instance_count'}
+            ],
+            columns: [{
+                id: 'severity',
+                dataIndex: 'severity',
+                header: _t('Events'),
+                renderer: Zenoss.render.severity,
+                width: 50
+            },{
+                id: 'name',
+                dataIndex: 'name',
+                header: _t('Name'),
+                renderer: Zenoss.render.aws_entityLinkFromGrid
+            },{
+                id: 'region',
+                dataIndex: 'region',
+                header: _t('Region'),
+                renderer: Zenoss.render.aws_entityLinkFromGrid,
+                width: 90
+            },{
+                id: 'dimension_name',
+                dataIndex: 'dimension_name',
+                header: _t('Grouped By'),
+                width: 90
+            },{
+                id: 'dimension_value',
+                dataIndex: 'dimension_value',
+                header: _t('Value'),
+                width: 110
+            },{
+                id: 'instance_count',
+                dataIndex: 'instance_count',
+                header: _t('Instances'),
+                width: 75
+            },{
+                id: 'monitored',
+                dataIndex: 'monitored',
+                header: _t('Monitored'),
+                renderer: Zenoss.render.checkbox,
+                width: 70
+            },{
+                id: 'locking',
+                dataIndex: 'locking',
+                header: _t('Locking'),
+                renderer: Zenoss.render.locking_icons,
+                width: 65
+            }]
+        });
+        ZC.EC2InstanceGroupPanel.superclass.constructor.call(this, config);
+    }
+});
+
+Ext.reg('EC2InstanceGroupPanel', ZC.EC2InstanceGroupPanel);
+
+
 /* Subcomponent Panels */
 
 Zenoss.nav.appendTo('Component', [{
@@ -702,6 +776,22 @@ Zenoss.nav.appendTo('Component', [{
     }
 }]);
 
+Zenoss.nav.appendTo('Component', [{
+    id: 'component_instance_groups',
+    text: _t('Instance Groups'),
+    xtype: 'EC2InstanceGroupPanel',
+    subComponentGridPanel: true,
+    filterNav: function(navpanel) {
+        switch (navpanel.refOwner.componentType) {
+            case 'EC2Region': return true;
+            default: return false;
+        }
+    },
+    setContext: function(uid) {
+        ZC.EC2InstanceGroupPanel.superclass.setContext.apply(this, [uid]);
+    }
+}]);
+
 Zenoss.nav.appendTo('Component', [{
     id: 'component_zones',
     text: _t('Zones'),
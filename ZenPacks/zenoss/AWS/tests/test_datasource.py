@@ -0,0 +1,634 @@
+##############################################################################
+#
+# Copyright (C) Zenoss, Inc. 2013, all rights reserved.
+#
+# This content is made available according to terms specified in
+# License.zenoss under the directory where your Zenoss product is installed.
+#
+##############################################################################
+
+import urlparse
+
+from twisted.internet import defer
+from twisted.internet.task import Clock
+from twisted.web.error import Error
+
+from Products.ZenTestCase.BaseTestCase import BaseTestCase
+
+from ZenPacks.zenoss.AWS import ZenPack
+from ZenPacks.zenoss.AWS.datasources import AmazonCloudWatchDataSource as cw
+
+
+class DataPointConfig(object):
+    def __init__(self, id):
+        self.id = id
+
+
+class DataSourceConfig(object):
+    '''
+    Minimal stand-in for a PythonCollector datasource config.
+    '''
+
+    cycletime = 300
+    zAWSCloudWatchAlignPolls = False
+    zAWSEventRefreshInterval = 3600
+
+    def __init__(self, component, datasource, points=(), **params):
+        self.component = component
+        self.datasource = datasource
+        self.points = [DataPointConfig(x) for x in (datasource,) + points]
+        self.params = {
+            'namespace': 'AWS/EC2',
+            'metric': datasource,
+            'statistics': ['Average', 'Maximum'],
+            'dimension': 'InstanceId=%s' % component,
+            'region': 'us-east-1',
+            'publish_period': 300,
+            }
+
+        self.params.update(params)
+        self.params.setdefault(
+            'statistic', ', '.join(self.params['statistics']))
+
+
+class Config(object):
+    def __init__(self, datasources, id='account'):
+        self.id = id
+        self.datasources = datasources
+
+
+def members(*timestamps):
+    '''
+    Return parsed GetMetricStatistics members for timestamps.
+    '''
+    return [
+        (x, {'Average': str(x % 100), 'Maximum': str(x % 100 + 1)})
+        for x in timestamps]
+
+
+def statistics_response(*members):
+    '''
+    Return a GetMetricStatistics response body for (time, values) members.
+    '''
+    return (
+        '<GetMetricStatisticsResponse xmlns="http://monitoring.amazonaws.com'
+        '/doc/2010-08-01/"><GetMetricStatisticsResult><Datapoints>%s'
+        '</Datapoints></GetMetricStatisticsResult>'
+        '</GetMetricStatisticsResponse>') % ''.join(
+            '<member><Timestamp>%s</Timestamp>%s</member>' % (
+                timestamp,
+                ''.join('<%s>%s</%s>' % (k, v, k) for k, v in values))
+            for timestamp, values in members)
+
+
+class HTTPClient(object):
+    '''
+    Stand-in for the httpclient module answering GetMetricStatistics
+    requests with the response for their InstanceId.
+    '''
+
+    def __init__(self, responses):
+        self.responses = responses
+        self.requested = []
+
+    def configure(self, **kwargs):
+        pass
+
+    def get_page(self, url):
+        query = dict(urlparse.parse_qsl(urlparse.urlparse(url).query))
+        instance_id = query.get('Dimensions.member.1.Value')
+        self.requested.append(instance_id)
+        return defer.succeed(self.responses[instance_id])
+
+
+class TestDatapoints(BaseTestCase):
+    def afterSetUp(self):
+        super(TestDatapoints, self).afterSetUp()
+        cw._last_timestamps.clear()
+        cw._last_written.clear()
+        cw.suppressed_writes.clear()
+
+    def test_datasources_sharing_component(self):
+        cpu = DataSourceConfig('i-1', 'CPUUtilization', ('Maximum',))
+        network = DataSourceConfig('i-1', 'NetworkIn', ('Maximum',))
+        config = Config([cpu, network])
+
+        self.assertEqual(
+            cw.datapoints_from_members(config, cpu, members(600, 900)),
+            [('i-1', 'CPUUtilization', '0', 600),
+             ('i-1', 'CPUUtilization', '0', 900),
+             ('i-1', 'CPUUtilization_Maximum', '1', 600),
+             ('i-1', 'CPUUtilization_Maximum', '1', 900)])
+
+        self.assertEqual(
+            cw.datapoints_from_members(config, network, members(600, 900)),
+            [('i-1', 'NetworkIn', '0', 600),
+             ('i-1', 'NetworkIn', '0', 900),
+             ('i-1', 'NetworkIn_Maximum', '1', 600),
+             ('i-1', 'NetworkIn_Maximum', '1', 900)])
+
+        self.assertEqual(cw.suppressed_writes['account'], 0)
+
+    def test_duplicates_suppressed(self):
+        cpu = DataSourceConfig('i-1', 'CPUUtilization', ('Maximum',))
+        config = Config([cpu])
+
+        cw.datapoints_from_members(config, cpu, members(600, 900))
+
+        # The newest period is returned again on the next cycle.
+        self.assertEqual(
+            cw.datapoints_from_members(config, cpu, members(900, 1200)),
+            [('i-1', 'CPUUtilization', '0', 1200),
+             ('i-1', 'CPUUtilization_Maximum', '1', 1200)])
+
+        self.assertEqual(cw.suppressed_writes['account'], 2)
+
+        # Values revised after they were written aren't written again.
+        self.assertEqual(
+            cw.datapoints_from_members(
+                config, cpu, [(1200, {'Average': '5', 'Maximum': '6'})]),
+            [])
+
+        # Other devices have their own newest values.
+        other = Config([cpu], id='other')
+        self.assertEqual(
+            len(cw.datapoints_from_members(other, cpu, members(900))), 2)
+
+        self.assertEqual(cw.suppressed_writes['other'], 0)
+
+
+class TestPublishLag(BaseTestCase):
+    def afterSetUp(self):
+        super(TestPublishLag, self).afterSetUp()
+        cw._last_timestamps.clear()
+        cw._last_written.clear()
+        cw._publish_lag.clear()
+        cw._polled_new_data.clear()
+
+    def test_publish_delay(self):
+        key = ('account', 'i-1', 'CPUUtilization')
+
+        # Nothing stored yet.
+        self.assertEqual(cw.publish_delay(key, None, 300, 300), 0)
+
+        # The period starting at 1500 is published at 1800, and
+        # available DEFAULT_PUBLISH_LAG seconds later.
+        self.assertEqual(
+            cw.publish_delay(key, 1200, 300, 300, now=1800),
+            cw.DEFAULT_PUBLISH_LAG)
+
+        self.assertEqual(cw.publish_delay(key, 1200, 300, 300, now=2000), 0)
+
+        # Detailed monitoring publishes the same period every minute.
+        cw._publish_lag[key] = 30
+        self.assertEqual(
+            cw.publish_delay(key, 1200, 300, 60, now=1800), 30)
+
+    def test_learn_publish_lag(self):
+        key = ('account', 'i-1', 'CPUUtilization')
+
+        cw.learn_publish_lag(key)
+        self.assertEqual(cw._publish_lag[key], 190)
+
+        for i in range(10):
+            cw.learn_publish_lag(key)
+
+        self.assertEqual(cw._publish_lag[key], cw.MAX_PUBLISH_LAG)
+
+        # Observed lags only lower the estimate.
+        cw.learn_publish_lag(key, 1000)
+        self.assertEqual(cw._publish_lag[key], cw.MAX_PUBLISH_LAG)
+
+        cw.learn_publish_lag(key, 100)
+        self.assertEqual(cw._publish_lag[key], 500)
+
+        # Other datasources keep their own estimate.
+        self.assertEqual(
+            cw.publish_delay(
+                ('account', 'i-2', 'CPUUtilization'), 1200, 300, 300,
+                now=1800),
+            cw.DEFAULT_PUBLISH_LAG)
+
+    def test_stopped_instance(self):
+        cpu = DataSourceConfig('i-1', 'CPUUtilization')
+        cpu.zAWSCloudWatchAlignPolls = True
+        config = Config([cpu])
+        key = cw.window_key(config, cpu)
+
+        cw.datapoints_from_members(config, cpu, members(600, 900))
+
+        # The first empty poll may have been early, but a stopped
+        # instance's empty polls after that don't raise the lag.
+        for i in range(4):
+            cw.datapoints_from_members(config, cpu, [])
+
+        self.assertEqual(cw._publish_lag[key], 190)
+
+
+class TestPruneState(BaseTestCase):
+    def afterSetUp(self):
+        super(TestPruneState, self).afterSetUp()
+        cw._last_timestamps.clear()
+        cw._last_written.clear()
+        cw._publish_lag.clear()
+        cw._polled_new_data.clear()
+        cw._event_states.clear()
+
+    def test_prune_state(self):
+        now = 100000
+        old = now - 3600
+
+        for component, timestamp in (('i-1', now - 300), ('i-2', old)):
+            key = ('account', component, 'CPUUtilization')
+            cw._last_timestamps[key] = timestamp
+            cw._publish_lag[key] = 120
+            cw._polled_new_data[key] = True
+            cw._last_written[key + ('CPUUtilization',)] = timestamp
+            cw._event_states[('account', component, 'AWSVolume')] = (
+                'ok', timestamp)
+
+        # Never had data.
+        cw._polled_new_data[('account', 'i-3', 'CPUUtilization')] = False
+
+        # Other devices are pruned by their own tasks.
+        cw._last_timestamps[('other', 'i-2', 'CPUUtilization')] = old
+
+        cw.prune_state('account', 1800, now=now)
+
+        self.assertEqual(
+            sorted(cw._last_timestamps),
+            [('account', 'i-1', 'CPUUtilization'),
+             ('other', 'i-2', 'CPUUtilization')])
+
+        self.assertEqual(
+            cw._publish_lag.keys(), [('account', 'i-1', 'CPUUtilization')])
+
+        self.assertEqual(
+            cw._polled_new_data.keys(),
+            [('account', 'i-1', 'CPUUtilization')])
+
+        self.assertEqual(
+            cw._last_written.keys(),
+            [('account', 'i-1', 'CPUUtilization', 'CPUUtilization')])
+
+        self.assertEqual(
+            cw._event_states.keys(), [('account', 'i-1', 'AWSVolume')])
+
+    def test_prune_state_events_refresh(self):
+        now = 100000
+        cw._event_states[('account', 'vol-1', 'AWSVolume')] = (
+            'ok', now - 3600)
+
+        # Not sent again until the refresh interval has passed.
+        cw.prune_state('account', 1800, refresh_interval=7200, now=now)
+        self.assertEqual(len(cw._event_states), 1)
+
+        cw.prune_state('account', 1800, refresh_interval=600, now=now)
+        self.assertEqual(len(cw._event_states), 0)
+
+
+class TestRegionVolumeStatus(BaseTestCase):
+    def afterSetUp(self):
+        super(TestRegionVolumeStatus, self).afterSetUp()
+        self.clock = Clock()
+        self.calls = []
+
+    def fetch(self, volume_ids):
+        self.calls.append(volume_ids)
+        return [(x, 'ok') for x in volume_ids]
+
+    def get(self, shared, volume_id):
+        statuses = []
+        shared.get([volume_id], 300, self.fetch).addCallback(
+            statuses.append)
+
+        self.clock.advance(0)
+        return statuses[0].get(volume_id)
+
+    def test_staggered_tasks(self):
+        shared = cw.RegionVolumeStatus(clock=self.clock)
+        all_volumes = ['vol-1', 'vol-2', 'vol-3']
+
+        # Each volume's task starts 100 seconds after the previous one.
+        for cycle in range(3):
+            for volume_id in all_volumes:
+                self.assertEqual(self.get(shared, volume_id), 'ok')
+                self.clock.advance(100)
+
+        self.assertEqual(self.calls, [
+            ['vol-1'],
+            ['vol-1', 'vol-2'],
+            all_volumes,
+            all_volumes,
+            all_volumes,
+            ])
+
+        # Volumes no longer collected drop out after two cycles.
+        self.clock.advance(300)
+        self.get(shared, 'vol-1')
+        self.clock.advance(300)
+        self.get(shared, 'vol-1')
+
+        self.assertEqual(self.calls[-1], ['vol-1'])
+        self.assertEqual(shared.statuses.keys(), ['vol-1'])
+
+
+def not_found(*volume_ids):
+    '''
+    Return an InvalidVolume.NotFound error for volume_ids.
+    '''
+    return Error('400', 'Bad Request', (
+        '<Response><Errors><Error><Code>InvalidVolume.NotFound</Code>'
+        '<Message>The volume(s) \'%s\' does not exist.</Message>'
+        '</Error></Errors></Response>') % ', '.join(volume_ids))
+
+
+def volume_status_response(statuses, next_token=None):
+    '''
+    Return a DescribeVolumeStatus response body.
+    '''
+    return (
+        '<DescribeVolumeStatusResponse xmlns="http://ec2.amazonaws.com/doc/'
+        '2013-02-01/"><volumeStatusSet>%s</volumeStatusSet>%s'
+        '</DescribeVolumeStatusResponse>') % (
+            ''.join(
+                '<item><volumeId>%s</volumeId><volumeStatus><status>%s'
+                '</status></volumeStatus></item>' % x for x in statuses),
+            '<nextToken>%s</nextToken>' % next_token if next_token else '')
+
+
+class TestDescribeVolumeStatus(BaseTestCase):
+    def test_missing_volumes(self):
+        short_id = 'vol-1a2b3c4d'
+        long_id = 'vol-1a2b3c4d5e6f7a8b9'
+
+        # Short ids are prefixes of long ids. Only exact ids match.
+        self.assertEqual(
+            cw.missing_volumes(not_found(long_id), [short_id, long_id]),
+            set([long_id]))
+
+        self.assertEqual(
+            cw.missing_volumes(
+                not_found(short_id, 'vol-1234abcd'), [short_id, long_id]),
+            set([short_id]))
+
+        self.assertEqual(
+            cw.missing_volumes(Error('503', 'Unavailable', ''), [short_id]),
+            set())
+
+    def test_missing_volume_retried(self):
+        requests = []
+
+        def request_page(volume_ids, next_token):
+            requests.append((list(volume_ids), next_token))
+
+            # The first page is returned before the missing volume is.
+            if next_token:
+                if 'vol-3' in volume_ids:
+                    return defer.fail(not_found('vol-3'))
+
+                return defer.succeed(volume_status_response(
+                    [('vol-2', 'impaired')]))
+
+            return defer.succeed(volume_status_response(
+                [('vol-1', 'ok')], next_token='2'))
+
+        statuses = []
+        cw.describe_volume_status(
+            'account', 'us-east-1', ['vol-1', 'vol-2', 'vol-3'],
+            request_page).addCallback(statuses.append)
+
+        self.assertEqual(statuses, [{'vol-1': 'ok', 'vol-2': 'impaired'}])
+        self.assertEqual(requests, [
+            (['vol-1', 'vol-2', 'vol-3'], None),
+            (['vol-1', 'vol-2', 'vol-3'], '2'),
+            (['vol-1', 'vol-2'], None),
+            (['vol-1', 'vol-2'], '2'),
+            ])
+
+
+class TestMetricListing(BaseTestCase):
+    def test_may_exist(self):
+        listing = cw.MetricListing([
+            ('CPUUtilization', (('InstanceId', 'i-1'),)),
+            ('CPUUtilization', (('InstanceId', 'i-2'),)),
+            ('DiskReadOps', (('InstanceId', 'i-2'),)),
+            ])
+
+        self.assertTrue(
+            listing.may_exist('CPUUtilization', [('InstanceId', 'i-1')]))
+
+        # Listed dimensions without the metric have no data for it.
+        self.assertFalse(
+            listing.may_exist('DiskReadOps', [('InstanceId', 'i-1')]))
+
+        # Dimensions not listed may be for a new instance.
+        self.assertTrue(
+            listing.may_exist('DiskReadOps', [('InstanceId', 'i-3')]))
+
+        # Metrics not listed at all aren't published.
+        self.assertFalse(
+            listing.may_exist('DiskWriteOps', [('InstanceId', 'i-3')]))
+
+
+class TestSharedRequest(BaseTestCase):
+    def afterSetUp(self):
+        super(TestSharedRequest, self).afterSetUp()
+        cw._shared_requests.clear()
+        self.reactor = cw.reactor
+        cw.reactor = Clock()
+        self.requests = 0
+
+    def beforeTearDown(self):
+        cw.reactor = self.reactor
+        super(TestSharedRequest, self).beforeTearDown()
+
+    def failing_request(self):
+        self.requests += 1
+        raise ValueError('AccessDenied')
+
+    def shared(self, **kwargs):
+        d, shared = cw.shared_request(
+            'ListMetrics', self.failing_request, ttl=3600, **kwargs)
+
+        errors = []
+        d.addErrback(errors.append)
+        self.assertEqual(len(errors), 1)
+        return shared
+
+    def test_failure_not_shared(self):
+        self.assertFalse(self.shared())
+        self.assertFalse(self.shared())
+        self.assertEqual(self.requests, 2)
+
+    def test_failure_shared(self):
+        self.assertFalse(self.shared(failure_ttl=60))
+        self.assertTrue(self.shared(failure_ttl=60))
+        self.assertEqual(self.requests, 1)
+
+        # Requested again once failure_ttl has passed.
+        cw.reactor.advance(60)
+        self.assertFalse(self.shared(failure_ttl=60))
+        self.assertEqual(self.requests, 2)
+
+
+class TestAggregateMembers(BaseTestCase):
+    def test_statistics(self):
+        statistics = ['Average', 'Sum', 'SampleCount', 'Maximum', 'Minimum']
+        sources = [
+            [(600, {'Average': '1', 'Sum': '2', 'SampleCount': '2',
+                    'Maximum': '1.5', 'Minimum': '0.5'})],
+            [(600, {'Average': '3', 'Sum': '3', 'SampleCount': '1',
+                    'Maximum': '3', 'Minimum': '3'})],
+            ]
+
+        self.assertEqual(cw.aggregate_members(statistics, sources), [
+            (600, {'Average': '2.0', 'Sum': '5.0', 'SampleCount': '3.0',
+                   'Maximum': '3.0', 'Minimum': '0.5'}),
+            ])
+
+    def test_partial_timestamps(self):
+        sources = [members(600, 900), members(600)]
+
+        # 900 is aggregated once the second component publishes it.
+        self.assertEqual(
+            cw.aggregate_members(['Maximum'], sources),
+            [(600, {'Maximum': '1.0'})])
+
+    def test_components_without_members(self):
+        sources = [members(600, 900), None, []]
+
+        self.assertEqual(
+            cw.aggregate_members(['Average'], sources),
+            [(600, {'Average': '0.0'}), (900, {'Average': '0.0'})])
+
+        self.assertEqual(cw.aggregate_members(['Average'], [None, []]), [])
+
+
+class TestAggregatePlanning(BaseTestCase):
+    def afterSetUp(self):
+        super(TestAggregatePlanning, self).afterSetUp()
+        cw._last_timestamps.clear()
+        cw._last_written.clear()
+        cw._shared_requests.clear()
+
+        self.patched = dict(
+            (x, getattr(cw, x)) for x in ('httpclient', 'reactor'))
+
+        cw.reactor = Clock()
+        cw.httpclient = HTTPClient({
+            'i-1': statistics_response(
+                ('2013-01-01T00:10:00Z', [('Average', '1')]),
+                ('2013-01-01T00:05:00Z', [('Average', '2')])),
+            'i-2': statistics_response(
+                ('2013-01-01T00:05:00Z', [('Average', '4')])),
+            })
+
+    def beforeTearDown(self):
+        for name, value in self.patched.items():
+            setattr(cw, name, value)
+
+        super(TestAggregatePlanning, self).beforeTearDown()
+
+    def collect(self, datasources):
+        for ds in datasources:
+            for name, default, _ in ZenPack.packZProperties:
+                setattr(ds, name, default)
+
+            ds.ec2accesskey = 'accesskey'
+            ds.ec2secretkey = 'secretkey'
+
+        results = []
+        plugin = cw.AmazonCloudWatchDataSourcePlugin()
+        plugin.collect(Config(datasources)).addCallback(results.extend)
+        return results
+
+    def test_region_computed(self):
+        region = DataSourceConfig(
+            'us-east-1', 'CPUUtilization', statistics=['Average'],
+            dimension='', aggregate_components=['i-1', 'i-2', 'i-3'])
+
+        results = self.collect([
+            region,
+            DataSourceConfig('i-1', 'CPUUtilization'),
+            DataSourceConfig('i-2', 'CPUUtilization'),
+            ])
+
+        # Only instances are requested, and i-3 isn't in this task.
+        self.assertEqual(sorted(cw.httpclient.requested), ['i-1', 'i-2'])
+
+        # 00:10 is left until i-2 has published it.
+        self.assertTrue(('collected', 'us-east-1') in results)
+        self.assertTrue((
+            'datapoints',
+            [('us-east-1', 'CPUUtilization', '3.0', 1356998700)],
+            ) in results)
+
+    def test_region_requested(self):
+        cw.httpclient.responses[None] = statistics_response()
+
+        # Instances not collecting every statistic can't be aggregated.
+        region = DataSourceConfig(
+            'us-east-1', 'CPUUtilization', statistics=['Average'],
+            dimension='', aggregate_components=['i-1'])
+
+        self.collect([
+            region,
+            DataSourceConfig(
+                'i-1', 'CPUUtilization', statistics=['Maximum']),
+            ])
+
+        self.assertEqual(sorted(cw.httpclient.requested), [None, 'i-1'])
+
+
+class TestEvents(BaseTestCase):
+    def afterSetUp(self):
+        super(TestEvents, self).afterSetUp()
+        cw._event_states.clear()
+        self.plugin = cw.AmazonCloudWatchDataSourcePlugin()
+        self.config = Config([DataSourceConfig('i-1', 'CPUUtilization')])
+
+    def component_clears(self, results):
+        data = self.plugin.onSuccess(results, self.config)
+        return [
+            (x['component'], x['eventKey']) for x in data['events']
+            if x.get('component') and
+            x['eventClassKey'] == 'AWSCloudWatchSuccess']
+
+    def test_clear_unknown_state(self):
+        results = [
+            ('collected', 'i-1'),
+            ('volumestatus', [('vol-1', 'ok')]),
+            ]
+
+        # Errors may have been reported before a restart.
+        self.assertEqual(self.component_clears(results), [
+            ('i-1', 'awsCloudWatchCollection'),
+            ('vol-1', 'awsVolumeStatus'),
+            ])
+
+        self.assertEqual(self.component_clears(results), [])
+
+        # Sent again after zAWSEventRefreshInterval.
+        key = ('account', 'i-1', 'awsCloudWatchCollection')
+        cw._event_states[key] = (cw.ZenEventClasses.Clear, 0)
+
+        self.assertEqual(
+            self.component_clears(results),
+            [('i-1', 'awsCloudWatchCollection')])
+
+
+def test_suite():
+    from unittest import TestSuite, makeSuite
+    suite = TestSuite()
+    suite.addTest(makeSuite(TestDatapoints))
+    suite.addTest(makeSuite(TestPublishLag))
+    suite.addTest(makeSuite(TestPruneState))
+    suite.addTest(makeSuite(TestRegionVolumeStatus))
+    suite.addTest(makeSuite(TestDescribeVolumeStatus))
+    suite.addTest(makeSuite(TestMetricListing))
+    suite.addTest(makeSuite(TestSharedRequest))
+    suite.addTest(makeSuite(TestAggregateMembers))
+    suite.addTest(makeSuite(TestAggregatePlanning))
+    suite.addTest(makeSuite(TestEvents))
+    return suite
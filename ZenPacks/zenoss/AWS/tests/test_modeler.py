@@ -0,0 +1,378 @@
+##############################################################################
+#
+# Copyright (C) Zenoss, Inc. 2013, all rights reserved.
+#
+# This content is made available according to terms specified in
+# License.zenoss under the directory where your Zenoss product is installed.
+#
+##############################################################################
+
+import logging
+
+from twisted.internet import defer
+
+from Products.DataCollector.plugins.DataMaps import ObjectMap, RelationshipMap
+from Products.ZenTestCase.BaseTestCase import BaseTestCase
+
+from ZenPacks.zenoss.AWS import parsers
+from ZenPacks.zenoss.AWS.modeler.plugins.aws import EC2
+
+
+log = logging.getLogger('zen.AWS')
+
+
+RESPONSES = {
+    'DescribeAvailabilityZones': (
+        '<DescribeAvailabilityZonesResponse>'
+        '<availabilityZoneInfo><item>'
+        '<zoneName>%(region)sa</zoneName>'
+        '<zoneState>available</zoneState>'
+        '</item></availabilityZoneInfo>'
+        '</DescribeAvailabilityZonesResponse>'),
+
+    'DescribeVpcs': '<DescribeVpcsResponse><vpcSet/></DescribeVpcsResponse>',
+
+    'DescribeSubnets': (
+        '<DescribeSubnetsResponse><subnetSet/></DescribeSubnetsResponse>'),
+
+    'DescribeInstances': (
+        '<DescribeInstancesResponse>'
+        '<reservationSet><item><instancesSet><item>'
+        '<instanceId>i-%(region)s</instanceId>'
+        '<imageId>ami-1a2b3c4d</imageId>'
+        '<instanceType>m1.small</instanceType>'
+        '</item></instancesSet></item></reservationSet>'
+        '</DescribeInstancesResponse>'),
+
+    'DescribeVolumes': (
+        '<DescribeVolumesResponse><volumeSet/></DescribeVolumesResponse>'),
+    }
+
+
+class Region(object):
+    def __init__(self, name):
+        self.name = name
+
+
+class Response(object):
+    status = 200
+    reason = 'OK'
+
+    def __init__(self, body):
+        self.body = body
+
+    def read(self):
+        return self.body
+
+
+class Connection(object):
+    '''
+    Stand-in for boto's EC2Connection and VPCConnection.
+    '''
+
+    ResponseError = Exception
+
+    def __init__(self, accesskey, secretkey, region=None):
+        self.region = region
+
+    def get_all_regions(self):
+        return [Region('us-east-1'), Region('eu-west-1')]
+
+    def build_filter_params(self, params, filters):
+        pass
+
+    def make_request(self, action, params, path, verb):
+        return Response(RESPONSES[action] % {'region': self.region.name})
+
+
+def volumes_response(volume_ids, next_token=None):
+    '''
+    Return a DescribeVolumes response body for 8 GiB volumes.
+    '''
+    return (
+        '<DescribeVolumesResponse><volumeSet>%s</volumeSet>%s'
+        '</DescribeVolumesResponse>') % (
+            ''.join(
+                '<item><volumeId>%s</volumeId><size>8</size></item>' % x
+                for x in volume_ids),
+            '<nextToken>%s</nextToken>' % next_token if next_token else '')
+
+
+class PagedConnection(object):
+    '''
+    Stand-in for a boto connection returning a page of results for each
+    NextToken.
+    '''
+
+    ResponseError = Exception
+    APIVersion = '2012-12-01'
+
+    def __init__(self, pages):
+        self.pages = pages
+        self.requests = []
+
+    def make_request(self, action, params, path, verb):
+        self.requests.append((self.APIVersion, action, dict(params)))
+        return Response(self.pages[params.get('NextToken')])
+
+
+class Threads(object):
+    '''
+    Stand-in for twisted.internet.threads. Calls are made when run is
+    called, last call first.
+    '''
+
+    def __init__(self):
+        self.pending = []
+
+    def deferToThread(self, f, *args, **kwargs):
+        d = defer.Deferred()
+        self.pending.append((d, f, args, kwargs))
+        return d
+
+    def run(self):
+        while self.pending:
+            d, f, args, kwargs = self.pending.pop()
+            d.callback(f(*args, **kwargs))
+
+
+class Device(object):
+    id = 'account'
+    ec2accesskey = 'accesskey'
+    ec2secretkey = 'secretkey'
+    zAWSSignatureVersion = 2
+    zAWSModelerMaxParallel = 10
+    zAWSModelerFullInterval = 24
+    model_token = None
+
+
+def zones_rm(*zone_ids):
+    return RelationshipMap(
+        compname='regions/us-east-1',
+        relname='zones',
+        modname=EC2.MODULE_NAME['EC2Zone'],
+        objmaps=[
+            ObjectMap(data={'id': x, 'title': x, 'state': 'available'})
+            for x in zone_ids])
+
+
+class TestCollect(BaseTestCase):
+    def afterSetUp(self):
+        super(TestCollect, self).afterSetUp()
+        EC2._relmap_hashes.clear()
+        EC2._pending_hashes.clear()
+        EC2._full_models.clear()
+
+        self.patched = dict(
+            (x, getattr(EC2, x))
+            for x in ('EC2Connection', 'VPCConnection', 'threads'))
+
+        self.threads = Threads()
+        EC2.EC2Connection = Connection
+        EC2.VPCConnection = Connection
+        EC2.threads = self.threads
+
+    def beforeTearDown(self):
+        for name, value in self.patched.items():
+            setattr(EC2, name, value)
+
+        super(TestCollect, self).beforeTearDown()
+
+    def test_results_in_call_order(self):
+        plugin = EC2.EC2()
+        device = Device()
+
+        results = []
+        plugin.collect(device, log).addCallback(results.append)
+        self.threads.run()
+
+        results = results[0]
+        self.assertEqual(
+            results['regions'],
+            [('us-east-1', 'us-east-1'), ('eu-west-1', 'eu-west-1')])
+
+        # Calls completing in any order are matched with their region.
+        self.assertEqual(
+            [(name, region_id) for name, region_id, _ in results['calls']],
+            [(name, region_id)
+             for region_id in ('us-east-1', 'eu-west-1')
+             for name in (
+                 'zones', 'VPCs', 'VPC subnets', 'instances', 'volumes')])
+
+        calls = dict(
+            ((name, region_id), result)
+            for name, region_id, result in results['calls'])
+
+        self.assertEqual(
+            [x.name for x in calls[('zones', 'eu-west-1')]], ['eu-west-1a'])
+
+        self.assertEqual(
+            [x['id'] for x in calls[('instances', 'us-east-1')]],
+            ['i-us-east-1'])
+
+        maps = plugin.process(device, results, log)
+
+        self.assertEqual(
+            [(x.relname, x.compname) for x in maps[:5]],
+            [('regions', ''),
+             ('instance_groups', 'regions/us-east-1'),
+             ('instance_groups', 'regions/eu-west-1'),
+             ('zones', 'regions/us-east-1'),
+             ('zones', 'regions/eu-west-1')])
+
+        # Only the account ObjectMaps follow the relationship maps.
+        self.assertEqual(maps[-2].setDiscoverGuests, True)
+        self.assertTrue(hasattr(maps[-1], 'model_token'))
+        self.assertTrue(isinstance(maps[-3], RelationshipMap))
+
+
+class TestChangedMaps(BaseTestCase):
+    def afterSetUp(self):
+        super(TestChangedMaps, self).afterSetUp()
+        EC2._relmap_hashes.clear()
+        EC2._pending_hashes.clear()
+        EC2._full_models.clear()
+        self.device = Device()
+
+    def changed(self, datamaps, now, applied=True):
+        '''
+        Return the maps changed_maps returns before the model token.
+        '''
+        changed = EC2.changed_maps(self.device, datamaps, log, now=now)
+        if applied:
+            self.device.model_token = changed[-1].model_token
+
+        return changed[:-1]
+
+    def test_unchanged_omitted(self):
+        account = ObjectMap(data={'setDiscoverGuests': True})
+
+        first = [zones_rm('us-east-1a', 'us-east-1b'), account]
+        self.assertEqual(self.changed(first, 100000), first)
+
+        # Equal maps are omitted. ObjectMaps are always returned.
+        self.assertEqual(
+            self.changed(
+                [zones_rm('us-east-1a', 'us-east-1b'), account], 100060),
+            [account])
+
+        changed = zones_rm('us-east-1a')
+        self.assertEqual(
+            self.changed([changed, account], 100120), [changed, account])
+
+    def test_objmap_order(self):
+        self.changed([zones_rm('us-east-1a', 'us-east-1b')], 100000)
+
+        self.assertEqual(
+            self.changed([zones_rm('us-east-1b', 'us-east-1a')], 100060),
+            [])
+
+        self.assertEqual(
+            EC2.relmap_hash(zones_rm('us-east-1a', 'us-east-1b')),
+            EC2.relmap_hash(zones_rm('us-east-1b', 'us-east-1a')))
+
+    def test_full_interval(self):
+        self.changed([zones_rm('us-east-1a')], 100000)
+
+        self.assertEqual(
+            len(self.changed([zones_rm('us-east-1a')], 100000 + 23 * 3600)),
+            0)
+
+        # Every map is returned again after zAWSModelerFullInterval.
+        self.assertEqual(
+            len(self.changed([zones_rm('us-east-1a')], 100000 + 24 * 3600)),
+            1)
+
+        self.assertEqual(
+            len(self.changed([zones_rm('us-east-1a')], 100000 + 25 * 3600)),
+            0)
+
+    def test_not_applied(self):
+        self.changed([zones_rm('us-east-1a')], 100000, applied=False)
+
+        # Maps are sent until the device has the model token.
+        self.assertEqual(
+            len(self.changed([zones_rm('us-east-1a')], 100060)), 1)
+
+        self.assertEqual(
+            len(self.changed([zones_rm('us-east-1a')], 100120)), 0)
+
+    def test_full_interval_zero(self):
+        self.device.zAWSModelerFullInterval = 0
+
+        for now in (100000, 100060, 100120):
+            self.assertEqual(
+                len(self.changed([zones_rm('us-east-1a')], now)), 1)
+
+
+class TestPaged(BaseTestCase):
+    def test_pages(self):
+        connection = PagedConnection({
+            None: volumes_response(['vol-1', 'vol-2'], next_token='2'),
+            '2': volumes_response(['vol-3']),
+            })
+
+        pages = EC2.paged(
+            connection, 'DescribeVolumes', parsers.parse_volumes,
+            page_size=2)
+
+        # Each page is requested once the previous one is consumed.
+        self.assertEqual(
+            [x.id for x in pages.next()], ['vol-1', 'vol-2'])
+        self.assertEqual(len(connection.requests), 1)
+
+        self.assertEqual([[x.id for x in page] for page in pages], [
+            ['vol-3'],
+            ])
+
+        self.assertEqual(connection.requests, [
+            (EC2.PAGED_API_VERSION, 'DescribeVolumes', {'MaxResults': 2}),
+            (EC2.PAGED_API_VERSION, 'DescribeVolumes',
+             {'MaxResults': 2, 'NextToken': '2'}),
+            ])
+
+    def test_empty_response(self):
+        connection = PagedConnection({None: ''})
+
+        pages = EC2.paged(
+            connection, 'DescribeVolumes', parsers.parse_volumes)
+
+        self.assertRaises(Exception, list, pages)
+
+    def test_volume_size(self):
+        volumes, _ = parsers.parse_volumes(volumes_response(['vol-1']))
+
+        # DescribeVolumes reports GiB.
+        self.assertEqual(
+            [x['size'] for x in EC2.volumes_data(volumes)], [8 * 1024 ** 3])
+
+
+class TestInstanceGroups(BaseTestCase):
+    def test_instance_groups_rm(self):
+        relmap = EC2.instance_groups_rm('us-east-1', [
+            {'instance_type': 'm1.small', 'image_id': 'ami-1'},
+            {'instance_type': 'm1.small', 'image_id': 'ami-2'},
+            {'instance_type': 't1.micro', 'image_id': 'ami-1'},
+            {'instance_type': 'm1.small', 'image_id': None},
+            ])
+
+        self.assertEqual(relmap.compname, 'regions/us-east-1')
+        self.assertEqual(relmap.relname, 'instance_groups')
+
+        self.assertEqual(
+            [(x.id, x.dimension_name, x.dimension_value, x.instance_count)
+             for x in relmap.maps],
+            [('ImageId-ami-1', 'ImageId', 'ami-1', 2),
+             ('ImageId-ami-2', 'ImageId', 'ami-2', 1),
+             ('InstanceType-m1.small', 'InstanceType', 'm1.small', 3),
+             ('InstanceType-t1.micro', 'InstanceType', 't1.micro', 1)])
+
+
+def test_suite():
+    from unittest import TestSuite, makeSuite
+    suite = TestSuite()
+    suite.addTest(makeSuite(TestCollect))
+    suite.addTest(makeSuite(TestChangedMaps))
+    suite.addTest(makeSuite(TestPaged))
+    suite.addTest(makeSuite(TestInstanceGroups))
+    return suite
@@ -0,0 +1,323 @@
+##############################################################################
+#
+# Copyright (C) Zenoss, Inc. 2013, all rights reserved.
+#
+# This content is made available according to terms specified in
+# License.zenoss under the directory where your Zenoss product is installed.
+#
+##############################################################################
+
+from Products.ZenTestCase.BaseTestCase import BaseTestCase
+
+from ZenPacks.zenoss.AWS.parsers import (
+    parse_instances,
+    parse_list_metrics,
+    parse_metric_statistics,
+    parse_volume_status,
+    parse_volumes,
+    parse_zones,
+    timestamp_from_iso8601,
+    )
+
+
+METRIC_STATISTICS_RESPONSE = '''<GetMetricStatisticsResponse xmlns="http://monitoring.amazonaws.com/doc/2010-08-01/">
+  <GetMetricStatisticsResult>
+    <Datapoints>
+      <member>
+        <Timestamp>2013-03-06T18:25:00Z</Timestamp>
+        <Unit>Percent</Unit>
+        <Maximum>4.5</Maximum>
+        <Average>1.366</Average>
+      </member>
+      <member>
+        <Timestamp>2013-03-06T18:20:00Z</Timestamp>
+        <Unit>Percent</Unit>
+        <Maximum>3.0</Maximum>
+        <Average>1.1</Average>
+      </member>
+      <member>
+        <Timestamp>not a timestamp</Timestamp>
+        <Average>9.9</Average>
+      </member>
+    </Datapoints>
+    <Label>CPUUtilization</Label>
+  </GetMetricStatisticsResult>
+  <ResponseMetadata>
+    <RequestId>4a4f8d6e-8689-11e2-b7b1-4d26b5b4bc2d</RequestId>
+  </ResponseMetadata>
+</GetMetricStatisticsResponse>
+'''
+
+VOLUME_STATUS_RESPONSE = '''<DescribeVolumeStatusResponse xmlns="http://ec2.amazonaws.com/doc/2012-12-01/">
+  <requestId>5jkdf074-37ed-4004-8671-a78ee82bf1cbEXAMPLE</requestId>
+  <volumeStatusSet>
+    <item>
+      <volumeId>vol-11111111</volumeId>
+      <availabilityZone>us-east-1d</availabilityZone>
+      <volumeStatus>
+        <status>ok</status>
+        <details>
+          <item>
+            <name>io-enabled</name>
+            <status>passed</status>
+          </item>
+        </details>
+      </volumeStatus>
+    </item>
+    <item>
+      <volumeId>vol-22222222</volumeId>
+      <availabilityZone>us-east-1c</availabilityZone>
+      <volumeStatus>
+        <status>impaired</status>
+        <details>
+          <item>
+            <name>io-enabled</name>
+            <status>failed</status>
+          </item>
+        </details>
+      </volumeStatus>
+    </item>
+  </volumeStatusSet>
+  <nextToken>token-2</nextToken>
+</DescribeVolumeStatusResponse>
+'''
+
+LIST_METRICS_RESPONSE = '''<ListMetricsResponse xmlns="http://monitoring.amazonaws.com/doc/2010-08-01/">
+  <ListMetricsResult>
+    <Metrics>
+      <member>
+        <Dimensions>
+          <member>
+            <Name>InstanceType</Name>
+            <Value>m1.small</Value>
+          </member>
+          <member>
+            <Name>AutoScalingGroupName</Name>
+            <Value>web</Value>
+          </member>
+        </Dimensions>
+        <MetricName>CPUUtilization</MetricName>
+        <Namespace>AWS/EC2</Namespace>
+      </member>
+      <member>
+        <Dimensions/>
+        <MetricName>NetworkIn</MetricName>
+        <Namespace>AWS/EC2</Namespace>
+      </member>
+    </Metrics>
+    <NextToken>token-2</NextToken>
+  </ListMetricsResult>
+  <ResponseMetadata>
+    <RequestId>d48ac2f4-8aa5-11e2-a4bf-0fb9d5fb6c73</RequestId>
+  </ResponseMetadata>
+</ListMetricsResponse>
+'''
+
+INSTANCES_RESPONSE = '''<DescribeInstancesResponse xmlns="http://ec2.amazonaws.com/doc/2014-10-01/">
+  <requestId>fdcdcab1-ae5c-489e-9c33-4637c5dda355</requestId>
+  <reservationSet>
+    <item>
+      <reservationId>r-1a2b3c4d</reservationId>
+      <ownerId>123456789012</ownerId>
+      <groupSet>
+        <item>
+          <groupId>sg-1a2b3c4d</groupId>
+          <groupName>default</groupName>
+        </item>
+      </groupSet>
+      <instancesSet>
+        <item>
+          <instanceId>i-1a2b3c4d</instanceId>
+          <imageId>ami-1a2b3c4d</imageId>
+          <instanceState>
+            <code>16</code>
+            <name>running</name>
+          </instanceState>
+          <privateDnsName>ip-10-0-0-12.ec2.internal</privateDnsName>
+          <dnsName>ec2-54-0-0-12.compute-1.amazonaws.com</dnsName>
+          <instanceType>m1.small</instanceType>
+          <launchTime>2013-03-06T18:20:00.000Z</launchTime>
+          <placement>
+            <availabilityZone>us-east-1a</availabilityZone>
+            <tenancy>default</tenancy>
+          </placement>
+          <monitoring>
+            <state>enabled</state>
+          </monitoring>
+          <subnetId>subnet-1a2b3c4d</subnetId>
+          <privateIpAddress>10.0.0.12</privateIpAddress>
+          <networkInterfaceSet>
+            <item>
+              <networkInterfaceId>eni-1a2b3c4d</networkInterfaceId>
+              <privateIpAddress>10.0.0.12</privateIpAddress>
+              <status>in-use</status>
+            </item>
+          </networkInterfaceSet>
+          <tagSet>
+            <item>
+              <key>Name</key>
+              <value>web-1</value>
+            </item>
+          </tagSet>
+        </item>
+        <item>
+          <instanceId>i-2a2b3c4d</instanceId>
+          <imageId>ami-1a2b3c4d</imageId>
+          <instanceState>
+            <code>80</code>
+            <name>stopped</name>
+          </instanceState>
+          <instanceType>t1.micro</instanceType>
+          <platform>windows</platform>
+          <monitoring>
+            <state>disabled</state>
+          </monitoring>
+        </item>
+      </instancesSet>
+    </item>
+  </reservationSet>
+  <nextToken>token-2</nextToken>
+</DescribeInstancesResponse>
+'''
+
+VOLUMES_RESPONSE = '''<DescribeVolumesResponse xmlns="http://ec2.amazonaws.com/doc/2014-10-01/">
+  <requestId>59dbff89-35bd-4eac-99ed-be587EXAMPLE</requestId>
+  <volumeSet>
+    <item>
+      <volumeId>vol-1a2b3c4d</volumeId>
+      <size>80</size>
+      <snapshotId/>
+      <availabilityZone>us-east-1a</availabilityZone>
+      <status>in-use</status>
+      <createTime>2013-03-06T18:20:00.000Z</createTime>
+      <attachmentSet>
+        <item>
+          <volumeId>vol-1a2b3c4d</volumeId>
+          <instanceId>i-1a2b3c4d</instanceId>
+          <device>/dev/sdh</device>
+          <status>attached</status>
+          <attachTime>2013-03-06T18:21:00.000Z</attachTime>
+          <deleteOnTermination>false</deleteOnTermination>
+        </item>
+      </attachmentSet>
+      <volumeType>io1</volumeType>
+      <iops>1000</iops>
+    </item>
+    <item>
+      <volumeId>vol-2a2b3c4d</volumeId>
+      <size>8</size>
+      <availabilityZone>us-east-1b</availabilityZone>
+      <status>available</status>
+      <attachmentSet/>
+      <volumeType>standard</volumeType>
+    </item>
+  </volumeSet>
+</DescribeVolumesResponse>
+'''
+
+ZONES_RESPONSE = '''<DescribeAvailabilityZonesResponse xmlns="http://ec2.amazonaws.com/doc/2014-10-01/">
+  <requestId>7a62c49f-347e-4fc4-9331-6e8eEXAMPLE</requestId>
+  <availabilityZoneInfo>
+    <item>
+      <zoneName>us-east-1a</zoneName>
+      <zoneState>available</zoneState>
+      <regionName>us-east-1</regionName>
+      <messageSet/>
+    </item>
+  </availabilityZoneInfo>
+</DescribeAvailabilityZonesResponse>
+'''
+
+
+class TestParsers(BaseTestCase):
+    def test_timestamp_from_iso8601(self):
+        self.assertEqual(
+            timestamp_from_iso8601('2013-03-06T18:20:00Z'), 1362594000)
+
+        self.assertEqual(
+            timestamp_from_iso8601('2013-03-06T18:20:00.000Z'), 1362594000)
+
+        self.assertRaises(ValueError, timestamp_from_iso8601, '2013-03-06')
+
+    def test_parse_metric_statistics(self):
+        points = parse_metric_statistics(METRIC_STATISTICS_RESPONSE)
+
+        self.assertEqual(points, [
+            (1362594000, {'Maximum': '3.0', 'Average': '1.1'}),
+            (1362594300, {'Maximum': '4.5', 'Average': '1.366'}),
+            ])
+
+    def test_parse_volume_status(self):
+        statuses, next_token = parse_volume_status(VOLUME_STATUS_RESPONSE)
+
+        self.assertEqual(statuses, [
+            ('vol-11111111', 'ok'),
+            ('vol-22222222', 'impaired'),
+            ])
+
+        self.assertEqual(next_token, 'token-2')
+
+    def test_parse_list_metrics(self):
+        metrics, next_token = parse_list_metrics(LIST_METRICS_RESPONSE)
+
+        self.assertEqual(metrics, [
+            ('CPUUtilization', (
+                ('AutoScalingGroupName', 'web'),
+                ('InstanceType', 'm1.small'))),
+            ('NetworkIn', ()),
+            ])
+
+        self.assertEqual(next_token, 'token-2')
+
+    def test_parse_instances(self):
+        instances, next_token = parse_instances(INSTANCES_RESPONSE)
+
+        self.assertEqual(
+            [(x.id, x.state, x.instance_type, x.monitored, x.platform)
+             for x in instances],
+            [('i-1a2b3c4d', 'running', 'm1.small', True, None),
+             ('i-2a2b3c4d', 'stopped', 't1.micro', False, 'windows')])
+
+        instance = instances[0]
+        self.assertEqual(instance.tags, {'Name': 'web-1'})
+        self.assertEqual(instance.placement, 'us-east-1a')
+        self.assertEqual(instance.subnet_id, 'subnet-1a2b3c4d')
+        self.assertEqual(instance.private_ip_address, '10.0.0.12')
+        self.assertEqual(
+            instance.public_dns_name,
+            'ec2-54-0-0-12.compute-1.amazonaws.com')
+
+        self.assertEqual(instances[1].tags, {})
+        self.assertEqual(next_token, 'token-2')
+
+    def test_parse_volumes(self):
+        volumes, next_token = parse_volumes(VOLUMES_RESPONSE)
+
+        self.assertEqual(
+            [(x.id, x.size, x.iops, x.type, x.zone, x.status)
+             for x in volumes],
+            [('vol-1a2b3c4d', 80, 1000, 'io1', 'us-east-1a', 'in-use'),
+             ('vol-2a2b3c4d', 8, None, 'standard', 'us-east-1b',
+              'available')])
+
+        attach_data = volumes[0].attach_data
+        self.assertEqual(attach_data.instance_id, 'i-1a2b3c4d')
+        self.assertEqual(attach_data.status, 'attached')
+        self.assertEqual(attach_data.device, '/dev/sdh')
+
+        self.assertEqual(volumes[1].attach_data.instance_id, None)
+        self.assertEqual(next_token, None)
+
+    def test_parse_zones(self):
+        zones, next_token = parse_zones(ZONES_RESPONSE)
+
+        self.assertEqual(
+            [(x.name, x.state) for x in zones],
+            [('us-east-1a', 'available')])
+
+
+def test_suite():
+    from unittest import TestSuite, makeSuite
+    suite = TestSuite()
+    suite.addTest(makeSuite(TestParsers))
+    return suite
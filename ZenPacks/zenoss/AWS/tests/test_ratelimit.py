@@ -0,0 +1,83 @@
+##############################################################################
+#
+# Copyright (C) Zenoss, Inc. 2013, all rights reserved.
+#
+# This content is made available according to terms specified in
+# License.zenoss under the directory where your Zenoss product is installed.
+#
+##############################################################################
+
+from twisted.internet.task import Clock
+from twisted.web.error import Error
+
+from Products.ZenTestCase.BaseTestCase import BaseTestCase
+
+from ZenPacks.zenoss.AWS.ratelimit import TokenBucket, is_throttling
+
+
+THROTTLING_RESPONSE = '''<ErrorResponse xmlns="http://monitoring.amazonaws.com/doc/2010-08-01/">
+  <Error>
+    <Type>Sender</Type>
+    <Code>Throttling</Code>
+    <Message>Rate exceeded</Message>
+  </Error>
+  <RequestId>8a7b9cb4-8c16-11e2-a4bf-0fb9d5fb6c73</RequestId>
+</ErrorResponse>
+'''
+
+
+class TestTokenBucket(BaseTestCase):
+    def afterSetUp(self):
+        super(TestTokenBucket, self).afterSetUp()
+        self.clock = Clock()
+        self.fired = []
+
+    def acquire(self, bucket, count):
+        for i in range(count):
+            bucket.acquire().addCallback(
+                lambda _, i=i: self.fired.append(i))
+
+    def test_burst(self):
+        bucket = TokenBucket(rate=2, burst=3, clock=self.clock)
+        self.acquire(bucket, 5)
+
+        self.assertEqual(self.fired, [0, 1, 2])
+
+        self.clock.advance(0.5)
+        self.assertEqual(self.fired, [0, 1, 2, 3])
+
+        self.clock.advance(0.5)
+        self.assertEqual(self.fired, [0, 1, 2, 3, 4])
+
+    def test_refill_capped_at_burst(self):
+        bucket = TokenBucket(rate=1, burst=2, clock=self.clock)
+        self.clock.advance(60)
+        self.acquire(bucket, 3)
+
+        self.assertEqual(self.fired, [0, 1])
+
+    def test_throttled(self):
+        bucket = TokenBucket(rate=1, burst=5, clock=self.clock)
+        bucket.throttled()
+        self.acquire(bucket, 1)
+
+        self.assertEqual(self.fired, [])
+
+        self.clock.advance(1)
+        self.assertEqual(self.fired, [0])
+
+    def test_is_throttling(self):
+        self.assertTrue(
+            is_throttling(Error('400', 'Bad Request', THROTTLING_RESPONSE)))
+
+        self.assertFalse(
+            is_throttling(Error('400', 'Bad Request', '<Code>Other</Code>')))
+
+        self.assertFalse(is_throttling(Exception('connection refused')))
+
+
+def test_suite():
+    from unittest import TestSuite, makeSuite
+    suite = TestSuite()
+    suite.addTest(makeSuite(TestTokenBucket))
+    return suite
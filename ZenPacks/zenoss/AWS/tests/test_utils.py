@@ -174,9 +174,113 @@ class TestUtils(BaseTestCase):
         self.assertEqual(zone1.instances.countObjects(), 0)
         self.assertEqual(zone2.instances.countObjects(), 0)
 
+    def test_build_region_relations(self):
+        from ZenPacks.zenoss.AWS import ZenPack
+        from ZenPacks.zenoss.AWS.EC2Region import EC2RegionInfo
+
+        # Regions created before instance groups were added.
+        region = self.account.getObjByPath('regions/region')
+        region._delObject('instance_groups')
+        self.assertFalse(hasattr(region, 'instance_groups'))
+
+        ZenPack('ZenPacks.zenoss.AWS').build_region_relations(self.dmd)
+
+        self.assertEqual(EC2RegionInfo(region).instance_group_count, 0)
+
+
+class TestQuerySigner(BaseTestCase):
+    def test_sign(self):
+        from ZenPacks.zenoss.AWS import utils
+
+        static = {
+            'Action': 'DescribeVolumeStatus',
+            'Version': '2013-02-01',
+            }
+
+        for i in range(1, 12):
+            static['VolumeId.%d' % i] = 'vol-%08d' % i
+
+        dynamic = {'NextToken': 'token/2'}
+
+        iso8601 = utils.iso8601
+        utils.iso8601 = lambda seconds_ago=0: '2013-03-06T18:20:00.000Z'
+        try:
+            request = dict(static, **dynamic)
+            request['SignatureMethod'] = 'HmacSHA256'
+            request['SignatureVersion'] = '2'
+
+            expected = utils.awsUrlSign(
+                'GET', 'ec2.us-east-1.amazonaws.com', '/', request,
+                ('accesskey', 'secretkey'))
+
+            signer = utils.QuerySigner(
+                'accesskey', 'secretkey', 'ec2.us-east-1.amazonaws.com')
+
+            # Second call uses the cached template.
+            self.assertEqual(signer.sign(static, dynamic), expected)
+            self.assertEqual(signer.sign(static, dynamic), expected)
+
+        finally:
+            utils.iso8601 = iso8601
+
+        # Parameters are ordered by name, so VolumeId.1 precedes
+        # VolumeId.10.
+        self.assertTrue(
+            expected.index('VolumeId.1=') < expected.index('VolumeId.10='))
+
+    def test_caches_bounded(self):
+        from ZenPacks.zenoss.AWS import utils
+
+        signer = utils.QuerySigner(
+            'accesskey', 'secretkey', 'ec2.us-east-1.amazonaws.com')
+
+        for i in range(utils.MAX_TEMPLATES + 10):
+            signer.template({'VolumeId.1': 'vol-%08d' % i}, ())
+
+        self.assertTrue(len(signer.templates) <= utils.MAX_TEMPLATES)
+
+        for i in range(utils.MAX_SIGNERS + 10):
+            utils.get_signer('accesskey%d' % i, 'secretkey', 'host')
+
+        self.assertTrue(len(utils._signers) <= utils.MAX_SIGNERS)
+
+    def test_signing_key(self):
+        import hashlib
+        import hmac
+
+        from ZenPacks.zenoss.AWS import utils
+
+        # Example from the AWS Signature Version 4 documentation.
+        k_signing = (
+            'f4780e2d9f65fa895f9c67b32ce1baf0'
+            'b0d8a43505a000a1a9e090d414db404d').decode('hex')
+
+        key = utils.signing_key(
+            'wJalrXUtnFEMI/K7MDENG+bPxRfiCYEXAMPLEKEY',
+            '20120215', 'us-east-1', 'iam')
+
+        signature = key.copy()
+        signature.update('string to sign')
+
+        self.assertEqual(
+            signature.hexdigest(),
+            hmac.new(k_signing, 'string to sign', hashlib.sha256).hexdigest())
+
+        # Cached until the date changes.
+        self.assertTrue(key is utils.signing_key(
+            'wJalrXUtnFEMI/K7MDENG+bPxRfiCYEXAMPLEKEY',
+            '20120215', 'us-east-1', 'iam'))
+
+        utils.signing_key(
+            'wJalrXUtnFEMI/K7MDENG+bPxRfiCYEXAMPLEKEY',
+            '20120216', 'us-east-1', 'iam')
+
+        self.assertEqual(len(utils._signing_keys), 1)
+
 
 def test_suite():
     from unittest import TestSuite, makeSuite
     suite = TestSuite()
     suite.addTest(makeSuite(TestUtils))
+    suite.addTest(makeSuite(TestQuerySigner))
     return suite
@@ -76,15 +76,10 @@ def awsUrlSign(
 
     httpRequest['AWSAccessKeyId'] = accesskey
 
-    # The query string needs to be url encoded prior to signing
-    queryString = urllib.urlencode(httpRequest)
-
-    # The query string needs to be in byte order
-    splitQuery = queryString.split('&')
-    splitQuery.sort()
-
-    # Now rejoin key/values for query string to sign
-    new_query_line = '&'.join(splitQuery)
+    # The query string needs to be url encoded prior to signing, and
+    # in byte order of parameter name. Sorting the encoded key=value
+    # pairs would put VolumeId.10 before VolumeId.1.
+    new_query_line = urllib.urlencode(sorted(httpRequest.items()))
 
     signme = '\n'.join([httpVerb, hostHeader, uriRequest, new_query_line])
 
@@ -99,6 +94,308 @@ def awsUrlSign(
     return '%s/?%s&%s' % (hostHeader, new_query_line, signature)
 
 
+# Query templates kept per signer. Parameter sets such as volume id
+# chunks change as resources come and go, so the cache is bounded.
+MAX_TEMPLATES = 1024
+
+
+class QuerySigner(object):
+    '''
+    Signature version 2 signer for one access key and endpoint.
+
+    Produces the same signed query strings as awsUrlSign. The HMAC key
+    state is computed once and copied for each signature, and the
+    sorted, encoded form of each distinct set of static parameters is
+    kept as a template so only the changing parameters are encoded per
+    request.
+    '''
+
+    rfc3986 = False
+
+    def __init__(self, accesskey, secretkey, hostHeader,
+                 httpVerb='GET', uriRequest='/'):
+        self.accesskey = accesskey
+        self.hostHeader = hostHeader
+        self.httpVerb = httpVerb
+        self.uriRequest = uriRequest
+        self.prefix = '\n'.join([httpVerb, hostHeader, uriRequest, ''])
+        self.hmac = hmac.new(secretkey, digestmod=hashlib.sha256)
+        self.templates = {}
+
+    def auth_params(self):
+        '''
+        Return parameters added to every request.
+        '''
+        return {
+            'AWSAccessKeyId': self.accesskey,
+            'SignatureMethod': 'HmacSHA256',
+            'SignatureVersion': '2',
+            }
+
+    def template(self, static, dynamic):
+        '''
+        Return a list of (name, fragment) tuples in query order. name is
+        None for a run of encoded static parameters, otherwise fragment
+        is the encoded "name=" prefix of a dynamic parameter.
+
+        dynamic must be a sorted tuple. Templates are cached per
+        distinct static parameters and dynamic names.
+        '''
+        key = (tuple(sorted(static.iteritems())), dynamic)
+
+        template = self.templates.get(key)
+        if template is not None:
+            return template
+
+        if len(self.templates) >= MAX_TEMPLATES:
+            self.templates.clear()
+
+        params = dict(static)
+        params.update(self.auth_params())
+
+        names = set(dynamic)
+
+        template = []
+        static_run = []
+        for name in sorted(names.union(params)):
+            if name in names:
+                if static_run:
+                    template.append((None, '&'.join(static_run)))
+                    static_run = []
+
+                template.append((
+                    name, quote_value(name, self.rfc3986) + '='))
+            else:
+                static_run.append('%s=%s' % (
+                    quote_value(name, self.rfc3986),
+                    quote_value(params[name], self.rfc3986)))
+
+        if static_run:
+            template.append((None, '&'.join(static_run)))
+
+        self.templates[key] = template
+        return template
+
+    def query(self, static, dynamic):
+        '''
+        Return the sorted, encoded query string for static and dynamic
+        parameters.
+        '''
+        fragments = []
+        for name, fragment in self.template(static, tuple(sorted(dynamic))):
+            if name is None:
+                fragments.append(fragment)
+            else:
+                fragments.append(
+                    fragment + quote_value(dynamic[name], self.rfc3986))
+
+        return '&'.join(fragments)
+
+    def sign(self, static, dynamic=None):
+        '''
+        Return a signed query URL without scheme, as awsUrlSign does.
+
+        static is a dict of parameters that are the same from one cycle
+        to the next. dynamic is a dict of parameters that change, such
+        as StartTime. Timestamp is added to dynamic.
+        '''
+        dynamic = dict(dynamic or ())
+        dynamic['Timestamp'] = iso8601()
+
+        query = self.query(static, dynamic)
+
+        new_hmac = self.hmac.copy()
+        new_hmac.update(self.prefix)
+        new_hmac.update(query)
+
+        return '%s/?%s&Signature=%s' % (
+            self.hostHeader,
+            query,
+            urllib.quote_plus(base64.b64encode(new_hmac.digest())))
+
+
+# Hex SHA-256 of the empty payload of a GET request.
+EMPTY_PAYLOAD_HASH = hashlib.sha256('').hexdigest()
+
+
+class QuerySignerV4(QuerySigner):
+    '''
+    Signature version 4 signer for one access key and endpoint.
+
+    Signs GET requests with the authentication parameters in the query
+    string. Derived signing keys are shared through signing_key.
+    '''
+
+    rfc3986 = True
+
+    def __init__(self, accesskey, secretkey, hostHeader, region, service,
+                 httpVerb='GET', uriRequest='/'):
+        super(QuerySignerV4, self).__init__(
+            accesskey, secretkey, hostHeader, httpVerb, uriRequest)
+
+        self.secretkey = secretkey
+        self.region = region
+        self.service = service
+
+    def auth_params(self):
+        return {
+            'X-Amz-Algorithm': 'AWS4-HMAC-SHA256',
+            'X-Amz-SignedHeaders': 'host',
+            }
+
+    def sign(self, static, dynamic=None):
+        '''
+        Return a signed query URL without scheme.
+
+        static and dynamic are the same as for QuerySigner.sign.
+        X-Amz-Date and X-Amz-Credential are added to dynamic.
+        '''
+        amz_date = datetime.datetime.utcnow().strftime('%Y%m%dT%H%M%SZ')
+        date = amz_date[:8]
+
+        scope = '/'.join((date, self.region, self.service, 'aws4_request'))
+
+        dynamic = dict(dynamic or ())
+        dynamic['X-Amz-Date'] = amz_date
+        dynamic['X-Amz-Credential'] = '%s/%s' % (self.accesskey, scope)
+
+        query = self.query(static, dynamic)
+
+        canonical_request = '\n'.join((
+            self.httpVerb,
+            self.uriRequest,
+            query,
+            'host:%s' % self.hostHeader,
+            '',
+            'host',
+            EMPTY_PAYLOAD_HASH))
+
+        new_hmac = signing_key(
+            self.secretkey, date, self.region, self.service).copy()
+
+        new_hmac.update('\n'.join((
+            'AWS4-HMAC-SHA256',
+            amz_date,
+            scope,
+            hashlib.sha256(canonical_request).hexdigest())))
+
+        return '%s/?%s&X-Amz-Signature=%s' % (
+            self.hostHeader, query, new_hmac.hexdigest())
+
+
+_signing_keys = {}
+_signing_keys_date = None
+
+
+def signing_key(secretkey, date, region, service):
+    '''
+    Return an HMAC object keyed with the signature version 4 signing key
+    for secretkey, date (YYYYMMDD), region and service. Callers must
+    copy it before use.
+
+    Derived keys are cached. The cache is emptied when the date changes
+    at UTC midnight.
+    '''
+    global _signing_keys_date
+
+    if date != _signing_keys_date:
+        if _signing_keys_date and date < _signing_keys_date:
+            # Request dated before midnight signed after the rollover.
+            return derive_signing_key(secretkey, date, region, service)
+
+        _signing_keys.clear()
+        _signing_keys_date = date
+
+    key = (secretkey, region, service)
+
+    signing_hmac = _signing_keys.get(key)
+    if signing_hmac is None:
+        signing_hmac = _signing_keys[key] = derive_signing_key(
+            secretkey, date, region, service)
+
+    return signing_hmac
+
+
+def derive_signing_key(secretkey, date, region, service):
+    '''
+    Return an HMAC object keyed with the signature version 4 signing key
+    for secretkey, date, region and service.
+    '''
+    def sign(key, msg):
+        return hmac.new(key, msg, hashlib.sha256).digest()
+
+    k_date = sign(('AWS4' + secretkey).encode('utf-8'), date)
+    k_region = sign(k_date, region)
+    k_service = sign(k_region, service)
+    k_signing = sign(k_service, 'aws4_request')
+
+    return hmac.new(k_signing, digestmod=hashlib.sha256)
+
+
+_quoted = {}
+
+
+def quote_value(value, rfc3986=False):
+    '''
+    Return value encoded for a query string. Encoding matches
+    urllib.urlencode, or RFC 3986 as signature version 4 requires if
+    rfc3986 is True.
+
+    Timestamps repeat across the requests made within each second, so
+    recent encodings are cached.
+    '''
+    key = (value, rfc3986)
+
+    quoted = _quoted.get(key)
+    if quoted is None:
+        if len(_quoted) > 1024:
+            _quoted.clear()
+
+        if rfc3986:
+            quoted = urllib.quote(str(value), safe='-_.~')
+        else:
+            quoted = urllib.quote_plus(str(value))
+
+        _quoted[key] = quoted
+
+    return quoted
+
+
+_signers = {}
+
+# Signers are kept per access key, endpoint and signature version.
+MAX_SIGNERS = 256
+
+
+def get_signer(accesskey, secretkey, hostHeader, version=2,
+               region=None, service=None):
+    '''
+    Return the shared signer for accesskey and hostHeader.
+
+    version 4 requires region and service, such as us-east-1 and
+    monitoring. Other versions return a signature version 2 signer.
+    '''
+    if version != 4:
+        version = 2
+
+    key = (accesskey, secretkey, hostHeader, version, region, service)
+
+    signer = _signers.get(key)
+    if signer is None:
+        if version == 4:
+            signer = QuerySignerV4(
+                accesskey, secretkey, hostHeader, region, service)
+        else:
+            signer = QuerySigner(accesskey, secretkey, hostHeader)
+
+        if len(_signers) >= MAX_SIGNERS:
+            _signers.clear()
+
+        _signers[key] = signer
+
+    return signer
+
+
 def getSESRegions():
     addLocalLibPath()
     import boto.ses
@@ -124,6 +421,21 @@ def lookup_cwregion(value):
         }.get(value, 'monitoring.us-east-1.amazonaws.com')
 
 
+def lookup_ec2region(value):
+
+    # Data used to update regions endpoint for EC2.
+    return {
+        'us-east-1': 'ec2.us-east-1.amazonaws.com',
+        'us-west-1': 'ec2.us-west-1.amazonaws.com',
+        'us-west-2': 'ec2.us-west-2.amazonaws.com',
+        'sa-east-1': 'ec2.sa-east-1.amazonaws.com',
+        'eu-west-1': 'ec2.eu-west-1.amazonaws.com',
+        'ap-northeast-1': 'ec2.ap-northeast-1.amazonaws.com',
+        'ap-southeast-1': 'ec2.ap-southeast-1.amazonaws.com',
+        'ap-southeast-2': 'ec2.ap-southeast-2.amazonaws.com',
+        }.get(value, 'ec2.us-east-1.amazonaws.com')
+
+
 def result_errmsg(result):
     """Return a useful error message string given a twisted errBack result."""
     try:
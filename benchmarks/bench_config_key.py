@@ -0,0 +1,245 @@
+#!/usr/bin/env python
+##############################################################################
+#
+# Copyright (C) Zenoss, Inc. 2013, all rights reserved.
+#
+# This content is made available according to terms specified in
+# License.zenoss under the directory where your Zenoss product is installed.
+#
+##############################################################################
+
+"""
+Compare zenpython task counts and scheduling overhead for the default
+per-metric config_key against zAWSCloudWatchGroupByRegion.
+
+A synthetic model is built from lightweight stand-ins for components and
+datasources (default 5000 instances with one volume each, spread across
+all regions). Each distinct config_key becomes one task, and each task is
+driven by a LoopingCall on a simulated clock the way zenpython schedules
+them. The time spent grouping configs and dispatching tasks is reported
+for both modes.
+
+The simulated clock keeps pending calls in a heap like the reactor does.
+twisted.internet.task.Clock sorts all pending calls on every callLater,
+so with thousands of tasks it would dominate the measurement.
+
+Must be run with the Zenoss python so the plugin can be imported:
+
+    python benchmarks/bench_config_key.py [instances] [cycles]
+"""
+
+import heapq
+import itertools
+import sys
+import time
+
+from collections import defaultdict
+
+from twisted.internet import task
+
+from ZenPacks.zenoss.AWS.datasources.AmazonCloudWatchDataSource \
+    import AmazonCloudWatchDataSourcePlugin
+
+
+REGIONS = (
+    'us-east-1', 'us-west-1', 'us-west-2', 'sa-east-1', 'eu-west-1',
+    'ap-northeast-1', 'ap-southeast-1', 'ap-southeast-2',
+    )
+
+INSTANCE_METRICS = (
+    'CPUUtilization', 'DiskReadOps', 'DiskWriteOps', 'DiskReadBytes',
+    'DiskWriteBytes', 'NetworkIn', 'NetworkOut',
+    'StatusCheckFailed_Instance', 'StatusCheckFailed_System',
+    )
+
+VOLUME_METRICS = (
+    'VolumeReadBytes', 'VolumeWriteBytes', 'VolumeReadOps',
+    'VolumeWriteOps', 'VolumeTotalReadTime', 'VolumeTotalWriteTime',
+    'VolumeIdleTime', 'VolumeQueueLength',
+    )
+
+CYCLETIME = 300
+
+
+class HeapCall(object):
+    '''
+    Pending call scheduled on a HeapClock.
+    '''
+
+    def __init__(self, time_, f, args, kwargs):
+        self.time = time_
+        self.f = f
+        self.args = args
+        self.kwargs = kwargs
+        self.cancelled = False
+        self.called = False
+
+    def getTime(self):
+        return self.time
+
+    def active(self):
+        return not (self.cancelled or self.called)
+
+    def cancel(self):
+        self.cancelled = True
+
+
+class HeapClock(object):
+    '''
+    Simulated IReactorTime keeping pending calls in a heap, so each
+    callLater costs O(log n) as it does in the reactor.
+    '''
+
+    def __init__(self):
+        self.now = 0.0
+        self.calls = []
+        self.sequence = itertools.count()
+
+    def seconds(self):
+        return self.now
+
+    def callLater(self, delay, f, *args, **kwargs):
+        call = HeapCall(self.now + delay, f, args, kwargs)
+        heapq.heappush(self.calls, (call.time, next(self.sequence), call))
+        return call
+
+    def advance(self, amount):
+        self.now += amount
+
+        while self.calls and self.calls[0][0] <= self.now:
+            _, _, call = heapq.heappop(self.calls)
+            if call.cancelled:
+                continue
+
+            call.called = True
+            call.f(*call.args, **call.kwargs)
+
+
+class FakeDevice(object):
+    id = 'account'
+
+    def __init__(self, group_by_region):
+        self.zAWSCloudWatchGroupByRegion = group_by_region
+
+
+class FakeComponent(object):
+    def __init__(self, device, id_, region_id, dimension):
+        self._device = device
+        self.id = id_
+        self._region_id = region_id
+        self._dimension = dimension
+
+    def device(self):
+        return self._device
+
+    def getRegionId(self):
+        return self._region_id
+
+    def getDimension(self):
+        return self._dimension
+
+
+class FakeDataSource(object):
+    def __init__(self, namespace, metric):
+        self.namespace = namespace
+        self.metric = metric
+
+    def getCycleTime(self, context):
+        return CYCLETIME
+
+
+def build_model(device, instances):
+    '''
+    Return a list of (datasource, component) pairs.
+    '''
+    pairs = []
+
+    instance_datasources = [
+        FakeDataSource('AWS/EC2', m) for m in INSTANCE_METRICS]
+
+    volume_datasources = [
+        FakeDataSource('AWS/EBS', m) for m in VOLUME_METRICS]
+
+    for i in xrange(instances):
+        region_id = REGIONS[i % len(REGIONS)]
+
+        instance = FakeComponent(
+            device, 'i-%08x' % i, region_id, 'InstanceId=i-%08x' % i)
+
+        volume = FakeComponent(
+            device, 'vol-%08x' % i, region_id, 'VolumeId=vol-%08x' % i)
+
+        pairs.extend((ds, instance) for ds in instance_datasources)
+        pairs.extend((ds, volume) for ds in volume_datasources)
+
+    return pairs
+
+
+def run(group_by_region, instances, cycles):
+    device = FakeDevice(group_by_region)
+    pairs = build_model(device, instances)
+
+    start = time.time()
+
+    tasks = defaultdict(list)
+    for datasource, context in pairs:
+        key = AmazonCloudWatchDataSourcePlugin.config_key(
+            datasource, context)
+
+        tasks[key].append(datasource)
+
+    grouped = time.time()
+
+    clock = HeapClock()
+    calls = [0]
+
+    def collect(datasources):
+        calls[0] += 1
+
+    loops = []
+    for datasources in tasks.itervalues():
+        loop = task.LoopingCall(collect, datasources)
+        loop.clock = clock
+        loop.start(CYCLETIME, now=False)
+        loops.append(loop)
+
+    for _ in xrange(cycles):
+        clock.advance(CYCLETIME)
+
+    for loop in loops:
+        loop.stop()
+
+    finished = time.time()
+
+    return {
+        'datasources': len(pairs),
+        'tasks': len(tasks),
+        'collect_calls': calls[0],
+        'group_seconds': grouped - start,
+        'schedule_seconds': finished - grouped,
+        }
+
+
+def main():
+    instances = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    cycles = int(sys.argv[2]) if len(sys.argv) > 2 else 12
+
+    print 'Model: %s instances, %s volumes, %s cycles' % (
+        instances, instances, cycles)
+
+    for label, group_by_region in (
+            ('per-metric', False), ('per-region', True)):
+
+        stats = run(group_by_region, instances, cycles)
+
+        print
+        print '%s config_key' % label
+        print '  datasources:      %d' % stats['datasources']
+        print '  tasks:            %d' % stats['tasks']
+        print '  collect() calls:  %d' % stats['collect_calls']
+        print '  grouping:         %.3fs' % stats['group_seconds']
+        print '  scheduling:       %.3fs' % stats['schedule_seconds']
+
+
+if __name__ == '__main__':
+    main()
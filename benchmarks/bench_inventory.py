@@ -0,0 +1,223 @@
+#!/usr/bin/env python
+##############################################################################
+#
+# Copyright (C) Zenoss, Inc. 2013, all rights reserved.
+#
+# This content is made available according to terms specified in
+# License.zenoss under the directory where your Zenoss product is installed.
+#
+##############################################################################
+
+"""
+Compare modeling of a recorded DescribeInstances response through boto's
+object model (SAX into Reservation and Instance objects) with the
+streaming record parser in ZenPacks.zenoss.AWS.parsers.
+
+Each approach is run in its own process so that peak resident memory
+can be reported alongside parse time.
+
+Must be run with the Zenoss python so the ZenPack and boto can be
+imported:
+
+    python benchmarks/bench_inventory.py [instances]
+"""
+
+import resource
+import subprocess
+import sys
+import time
+
+from ZenPacks.zenoss.AWS import parsers
+from ZenPacks.zenoss.AWS.modeler.plugins.aws import EC2
+
+
+def describe_instances_response(count, per_reservation=4):
+    '''
+    Return a recorded DescribeInstances response with count instances.
+    '''
+    reservations = []
+    for r in xrange(0, count, per_reservation):
+        instances = []
+        for i in xrange(r, min(count, r + per_reservation)):
+            instances.append(
+                '        <item>\n'
+                '          <instanceId>i-%08x</instanceId>\n'
+                '          <imageId>ami-%08x</imageId>\n'
+                '          <instanceState>\n'
+                '            <code>16</code>\n'
+                '            <name>running</name>\n'
+                '          </instanceState>\n'
+                '          <privateDnsName>ip-10-0-%d-%d.ec2.internal'
+                '</privateDnsName>\n'
+                '          <dnsName>ec2-54-0-%d-%d.compute-1.amazonaws.com'
+                '</dnsName>\n'
+                '          <keyName>deploy</keyName>\n'
+                '          <amiLaunchIndex>0</amiLaunchIndex>\n'
+                '          <instanceType>m1.small</instanceType>\n'
+                '          <launchTime>2013-03-06T18:20:00.000Z'
+                '</launchTime>\n'
+                '          <placement>\n'
+                '            <availabilityZone>us-east-1%s'
+                '</availabilityZone>\n'
+                '            <groupName/>\n'
+                '            <tenancy>default</tenancy>\n'
+                '          </placement>\n'
+                '          <monitoring>\n'
+                '            <state>disabled</state>\n'
+                '          </monitoring>\n'
+                '          <subnetId>subnet-%08x</subnetId>\n'
+                '          <vpcId>vpc-1a2b3c4d</vpcId>\n'
+                '          <privateIpAddress>10.0.%d.%d</privateIpAddress>\n'
+                '          <groupSet>\n'
+                '            <item>\n'
+                '              <groupId>sg-1a2b3c4d</groupId>\n'
+                '              <groupName>default</groupName>\n'
+                '            </item>\n'
+                '          </groupSet>\n'
+                '          <architecture>x86_64</architecture>\n'
+                '          <rootDeviceType>ebs</rootDeviceType>\n'
+                '          <rootDeviceName>/dev/sda1</rootDeviceName>\n'
+                '          <blockDeviceMapping>\n'
+                '            <item>\n'
+                '              <deviceName>/dev/sda1</deviceName>\n'
+                '              <ebs>\n'
+                '                <volumeId>vol-%08x</volumeId>\n'
+                '                <status>attached</status>\n'
+                '                <attachTime>2013-03-06T18:20:05.000Z'
+                '</attachTime>\n'
+                '                <deleteOnTermination>true'
+                '</deleteOnTermination>\n'
+                '              </ebs>\n'
+                '            </item>\n'
+                '          </blockDeviceMapping>\n'
+                '          <virtualizationType>paravirtual'
+                '</virtualizationType>\n'
+                '          <tagSet>\n'
+                '            <item>\n'
+                '              <key>Name</key>\n'
+                '              <value>web-%d</value>\n'
+                '            </item>\n'
+                '            <item>\n'
+                '              <key>Role</key>\n'
+                '              <value>web</value>\n'
+                '            </item>\n'
+                '          </tagSet>\n'
+                '          <hypervisor>xen</hypervisor>\n'
+                '          <networkInterfaceSet>\n'
+                '            <item>\n'
+                '              <networkInterfaceId>eni-%08x'
+                '</networkInterfaceId>\n'
+                '              <subnetId>subnet-%08x</subnetId>\n'
+                '              <vpcId>vpc-1a2b3c4d</vpcId>\n'
+                '              <status>in-use</status>\n'
+                '              <privateIpAddress>10.0.%d.%d'
+                '</privateIpAddress>\n'
+                '              <sourceDestCheck>true</sourceDestCheck>\n'
+                '            </item>\n'
+                '          </networkInterfaceSet>\n'
+                '          <ebsOptimized>false</ebsOptimized>\n'
+                '        </item>\n' % (
+                    i, i % 20,
+                    i / 256 % 256, i % 256,
+                    i / 256 % 256, i % 256,
+                    'abcd'[i % 4],
+                    i % 64,
+                    i / 256 % 256, i % 256,
+                    i, i, i, i % 64,
+                    i / 256 % 256, i % 256))
+
+        reservations.append(
+            '    <item>\n'
+            '      <reservationId>r-%08x</reservationId>\n'
+            '      <ownerId>123456789012</ownerId>\n'
+            '      <groupSet/>\n'
+            '      <instancesSet>\n'
+            '%s'
+            '      </instancesSet>\n'
+            '    </item>\n' % (r, ''.join(instances)))
+
+    return (
+        '<DescribeInstancesResponse'
+        ' xmlns="http://ec2.amazonaws.com/doc/2014-10-01/">\n'
+        '  <requestId>fdcdcab1-ae5c-489e-9c33-4637c5dda355</requestId>\n'
+        '  <reservationSet>\n'
+        '%s'
+        '  </reservationSet>\n'
+        '</DescribeInstancesResponse>\n') % ''.join(reservations)
+
+
+def legacy_instances(body):
+    import xml.sax
+
+    import boto.handler
+    from boto.ec2.instance import Reservation
+    from boto.resultset import ResultSet
+
+    reservations = ResultSet([('item', Reservation)])
+    xml.sax.parseString(body, boto.handler.XmlHandler(reservations, None))
+
+    instances = []
+    for reservation in reservations:
+        instances.extend(reservation.instances)
+
+    # Same fields the modeler read from boto's Instance objects.
+    instance_data = []
+    for instance in instances:
+        instance_data.append({
+            'id': instance.id,
+            'title': EC2.name_or(instance.tags, instance.id),
+            'state': instance.state,
+            'instance_type': instance.instance_type,
+            'image_id': instance.image_id,
+            'setZoneId': instance.placement,
+            'setVPCSubnetId': instance.subnet_id,
+            'private_ip_address': instance.private_ip_address,
+            })
+
+    return instance_data
+
+
+def current_instances(body):
+    records, _ = parsers.parse_instances(body)
+    return EC2.instances_data(records)
+
+
+MODES = {
+    'legacy': legacy_instances,
+    'parsers': current_instances,
+    }
+
+
+def run_mode(mode, count):
+    '''
+    Parse a response of count instances with mode and print the parse
+    time, instance count and peak resident memory.
+    '''
+    body = describe_instances_response(count)
+
+    start = time.time()
+    instance_data = MODES[mode](body)
+    elapsed = time.time() - start
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print '%s %d %f %d' % (mode, len(instance_data), elapsed, peak)
+
+
+def main(count):
+    body = describe_instances_response(count)
+    print 'DescribeInstances x%d (%.1f MB)' % (count, len(body) / 1e6)
+
+    for mode in ('legacy', 'parsers'):
+        output = subprocess.check_output(
+            [sys.executable, __file__, '--mode', mode, str(count)])
+
+        _, instances, elapsed, peak = output.split()
+        print '%-8s %6s instances  %7.2fs  peak RSS %6.1f MB' % (
+            mode, instances, float(elapsed), int(peak) / 1024.0)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == '--mode':
+        run_mode(sys.argv[2], int(sys.argv[3]))
+    else:
+        main(int(sys.argv[1]) if len(sys.argv) > 1 else 20000)
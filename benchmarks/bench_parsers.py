@@ -0,0 +1,149 @@
+#!/usr/bin/env python
+##############################################################################
+#
+# Copyright (C) Zenoss, Inc. 2013, all rights reserved.
+#
+# This content is made available according to terms specified in
+# License.zenoss under the directory where your Zenoss product is installed.
+#
+##############################################################################
+
+"""
+Compare parsing of recorded GetMetricStatistics and DescribeVolumeStatus
+responses with the previous onSuccess approach (namespace mangling,
+StringIO, uncompiled XPath strings and time.strptime) and with
+ZenPacks.zenoss.AWS.parsers.
+
+Must be run with the Zenoss python so the ZenPack can be imported:
+
+    python benchmarks/bench_parsers.py [iterations]
+"""
+
+import calendar
+import sys
+import time
+import timeit
+
+from cStringIO import StringIO
+from lxml import etree
+
+from ZenPacks.zenoss.AWS import parsers
+
+
+def metric_statistics_response(count):
+    '''
+    Return a recorded GetMetricStatistics response with count members.
+    '''
+    start = 1362594000
+    members = []
+    for i in xrange(count):
+        members.append(
+            '      <member>\n'
+            '        <Timestamp>%s</Timestamp>\n'
+            '        <Unit>Percent</Unit>\n'
+            '        <Average>%.3f</Average>\n'
+            '        <Maximum>%.3f</Maximum>\n'
+            '      </member>\n' % (
+                time.strftime(
+                    '%Y-%m-%dT%H:%M:%SZ', time.gmtime(start + i * 60)),
+                i * 0.5, i * 0.75))
+
+    return (
+        '<GetMetricStatisticsResponse'
+        ' xmlns="http://monitoring.amazonaws.com/doc/2010-08-01/">\n'
+        '  <GetMetricStatisticsResult>\n'
+        '    <Datapoints>\n'
+        '%s'
+        '    </Datapoints>\n'
+        '    <Label>CPUUtilization</Label>\n'
+        '  </GetMetricStatisticsResult>\n'
+        '  <ResponseMetadata>\n'
+        '    <RequestId>4a4f8d6e-8689-11e2-b7b1-4d26b5b4bc2d</RequestId>\n'
+        '  </ResponseMetadata>\n'
+        '</GetMetricStatisticsResponse>\n') % ''.join(members)
+
+
+def volume_status_response(count):
+    '''
+    Return a recorded DescribeVolumeStatus response with count items.
+    '''
+    items = []
+    for i in xrange(count):
+        items.append(
+            '    <item>\n'
+            '      <volumeId>vol-%08x</volumeId>\n'
+            '      <availabilityZone>us-east-1d</availabilityZone>\n'
+            '      <volumeStatus>\n'
+            '        <status>%s</status>\n'
+            '      </volumeStatus>\n'
+            '    </item>\n' % (i, 'impaired' if i % 10 == 0 else 'ok'))
+
+    return (
+        '<DescribeVolumeStatusResponse'
+        ' xmlns="http://ec2.amazonaws.com/doc/2012-12-01/">\n'
+        '  <requestId>5jkdf074-37ed-4004-8671-a78ee82bf1cb</requestId>\n'
+        '  <volumeStatusSet>\n'
+        '%s'
+        '  </volumeStatusSet>\n'
+        '</DescribeVolumeStatusResponse>\n') % ''.join(items)
+
+
+def legacy_metric_statistics(result, statistics=('Average', 'Maximum')):
+    result = result.replace(' xmlns=', ' xmlnamespace=', 1)
+    stats = etree.parse(StringIO(result))
+
+    points = []
+    for member in stats.xpath('//Datapoints/member'):
+        timestamp = calendar.timegm(time.strptime(
+            member.xpath('Timestamp/text()')[0], '%Y-%m-%dT%H:%M:%SZ'))
+
+        for statistic in statistics:
+            value = member.xpath('%s/text()' % statistic)
+            if value:
+                points.append((timestamp, statistic, value[0]))
+
+    return points
+
+
+def legacy_volume_status(result):
+    result = result.replace(' xmlns=', ' xmlnamespace=', 1)
+    stats = etree.parse(StringIO(result))
+
+    statuses = []
+    for vol in stats.xpath('//volumeStatusSet/item'):
+        statuses.append((
+            str(vol.xpath('volumeId[last()]/text()')[0]),
+            str(vol.xpath('volumeStatus/status/text()')[0])))
+
+    return statuses
+
+
+def compare(label, iterations, legacy, current):
+    legacy_time = min(timeit.repeat(legacy, number=iterations, repeat=3))
+    current_time = min(timeit.repeat(current, number=iterations, repeat=3))
+
+    print '%-28s legacy %8.1fus  parsers %8.1fus  speedup %5.2fx' % (
+        label,
+        1e6 * legacy_time / iterations,
+        1e6 * current_time / iterations,
+        legacy_time / current_time)
+
+
+def main(iterations):
+    for count in (1, 5, 60):
+        body = metric_statistics_response(count)
+        compare(
+            'GetMetricStatistics x%d' % count, iterations,
+            lambda: legacy_metric_statistics(body),
+            lambda: parsers.parse_metric_statistics(body))
+
+    for count in (1, 200):
+        body = volume_status_response(count)
+        compare(
+            'DescribeVolumeStatus x%d' % count, max(1, iterations / 10),
+            lambda: legacy_volume_status(body),
+            lambda: parsers.parse_volume_status(body))
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 2000)
@@ -0,0 +1,155 @@
+#!/usr/bin/env python
+##############################################################################
+#
+# Copyright (C) Zenoss, Inc. 2013, all rights reserved.
+#
+# This content is made available according to terms specified in
+# License.zenoss under the directory where your Zenoss product is installed.
+#
+##############################################################################
+
+"""
+Measure per-request HTTPS latency against a local TLS stub server.
+
+A self-signed certificate is generated and a stub server answering every
+request with a recorded GetMetricStatistics response is started on
+localhost. The same number of sequential requests is then made in three
+modes:
+
+    full handshake   new connection per request, no session reuse
+    resumed session  new connection per request, TLS session resumed
+    persistent       keep-alive connection from the shared pool
+
+Must be run with the Zenoss python so the ZenPack can be imported:
+
+    python benchmarks/bench_tls.py [requests]
+"""
+
+import sys
+import time
+
+from OpenSSL import crypto
+
+from twisted.internet import reactor, ssl
+from twisted.internet.defer import inlineCallbacks, returnValue
+from twisted.web.client import Agent, HTTPConnectionPool
+from twisted.web.resource import Resource
+from twisted.web.server import Site
+
+from ZenPacks.zenoss.AWS.httpclient import TLSSessionCache, request
+
+
+RESPONSE = '''<GetMetricStatisticsResponse xmlns="http://monitoring.amazonaws.com/doc/2010-08-01/">
+  <GetMetricStatisticsResult>
+    <Datapoints>
+      <member>
+        <Timestamp>2013-03-06T18:20:00Z</Timestamp>
+        <Unit>Percent</Unit>
+        <Average>1.3659999999999999</Average>
+      </member>
+    </Datapoints>
+    <Label>CPUUtilization</Label>
+  </GetMetricStatisticsResult>
+  <ResponseMetadata>
+    <RequestId>4a4f8d6e-8689-11e2-b7b1-4d26b5b4bc2d</RequestId>
+  </ResponseMetadata>
+</GetMetricStatisticsResponse>
+'''
+
+
+class StubResource(Resource):
+    isLeaf = True
+
+    def render_GET(self, request):
+        request.setHeader('Content-Type', 'text/xml')
+        return RESPONSE
+
+
+def self_signed(hostname='localhost'):
+    '''
+    Return (PKey, X509) for a throwaway self-signed certificate.
+    '''
+    key = crypto.PKey()
+    key.generate_key(crypto.TYPE_RSA, 2048)
+
+    cert = crypto.X509()
+    cert.get_subject().CN = hostname
+    cert.set_serial_number(1)
+    cert.gmtime_adj_notBefore(0)
+    cert.gmtime_adj_notAfter(3600)
+    cert.set_issuer(cert.get_subject())
+    cert.set_pubkey(key)
+    cert.sign(key, 'sha256')
+
+    return key, cert
+
+
+def summarize(label, latencies):
+    latencies = sorted(latencies)
+    count = len(latencies)
+
+    print '%-16s mean %7.2fms  p50 %7.2fms  p95 %7.2fms' % (
+        label,
+        1000 * sum(latencies) / count,
+        1000 * latencies[count / 2],
+        1000 * latencies[min(count - 1, int(count * 0.95))])
+
+
+@inlineCallbacks
+def measure(url, count, persistent, reuse_sessions, trust_root):
+    pool = HTTPConnectionPool(reactor, persistent=persistent)
+    agent = Agent(
+        reactor,
+        contextFactory=TLSSessionCache(
+            reuse_sessions=reuse_sessions, trust_root=trust_root),
+        pool=pool)
+
+    latencies = []
+    for _ in xrange(count):
+        start = time.time()
+        yield request(agent, url)
+        latencies.append(time.time() - start)
+
+    yield pool.closeCachedConnections()
+
+    # Discard the first request. It always pays for a full handshake.
+    latencies.pop(0)
+
+    returnValue(latencies)
+
+
+@inlineCallbacks
+def main(count):
+    key, cert = self_signed()
+
+    server_options = ssl.CertificateOptions(
+        privateKey=key, certificate=cert, enableSessions=True)
+
+    port = reactor.listenSSL(
+        0, Site(StubResource()), server_options, interface='127.0.0.1')
+
+    url = 'https://localhost:%d/' % port.getHost().port
+    trust_root = ssl.Certificate(cert)
+
+    try:
+        for label, persistent, reuse_sessions in (
+                ('full handshake', False, False),
+                ('resumed session', False, True),
+                ('persistent', True, True)):
+
+            latencies = yield measure(
+                url, count, persistent, reuse_sessions, trust_root)
+
+            summarize(label, latencies)
+
+    finally:
+        yield port.stopListening()
+        reactor.stop()
+
+
+if __name__ == '__main__':
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+
+    print 'Requests per mode: %d' % count
+    reactor.callWhenRunning(main, count)
+    reactor.run()